@@ -4,16 +4,20 @@ import shutil
 
 from utils.auth import UserAuth
 from utils.save_docs import save_docs_to_vectordb_user, get_user_documents
-from utils.save_urls import save_url_to_vectordb_user
 from utils.session_state import initialize_session_state_variables
 from utils.prepare_vectordb import (
-    get_vectorstore_user,
+    open_vectorstore_user,
     has_new_files_user,
     cleanup_user_data,
-    get_user_dirs
+    get_user_dirs,
+    IndexMismatchError
 )
+from utils.ingest_queue import get_ingest_queue
 from utils.chatbot import chat
 
+# --- Constants ---
+RESET_JOB_TIMEOUT = 30   # seconds to wait for a running job to stop before a reset
+
 
 class ChatApp:
     """
@@ -83,12 +87,6 @@ class ChatApp:
             # Xóa thông báo khỏi session state
             del st.session_state[upload_success_key]
 
-        # Kiểm tra thông báo từ việc xử lý vectorstore
-        vectorstore_success_key = f'vectorstore_success_{username}'
-        if vectorstore_success_key in st.session_state:
-            st.success(st.session_state[vectorstore_success_key])
-            del st.session_state[vectorstore_success_key]
-
         # Header with user info and logout
         col1, col2 = st.columns([3, 1])
         with col1:
@@ -134,18 +132,14 @@ class ChatApp:
                     with col2:
                         if f"confirm_delete_{username}" in st.session_state and st.session_state[f"confirm_delete_{username}"] == doc_to_delete:
                             if st.button("⚠️ Confirm", use_container_width=True, key=f"confirm_btn_{username}"):
-                                from utils.save_docs import delete_user_document
-                                if delete_user_document(username, doc_to_delete):
-                                    # Xóa vectorstore để force rebuild
-                                    user_vectordb_key = f'vectordb_{username}'
-                                    if user_vectordb_key in st.session_state:
-                                        del st.session_state[user_vectordb_key]
+                                # Xóa ở background worker
+                                get_ingest_queue().enqueue(username, "delete", {"filename": doc_to_delete})
 
-                                    # Xóa confirm state
-                                    if f"confirm_delete_{username}" in st.session_state:
-                                        del st.session_state[f"confirm_delete_{username}"]
+                                # Xóa confirm state
+                                if f"confirm_delete_{username}" in st.session_state:
+                                    del st.session_state[f"confirm_delete_{username}"]
 
-                                    st.rerun()
+                                st.rerun()
 
             uploaded_docs = st.file_uploader(
                 "Upload (.pdf, .txt, .doc, .docx, .xls, .xlsx)",
@@ -156,6 +150,7 @@ class ChatApp:
             if uploaded_docs:
                 new_files = save_docs_to_vectordb_user(username, uploaded_docs, user_docs)
                 if new_files:
+                    get_ingest_queue().enqueue(username, "ingest")
                     st.success(f"📁 Saved: {', '.join(new_files)}")
 
             st.subheader("🌐 Website URLs")
@@ -169,15 +164,17 @@ class ChatApp:
             self._handle_url_inputs_user(username)
 
             if st.button("🌐 Process URLs", use_container_width=True):
-                for url in st.session_state.get(f'url_inputs_{username}', [""]):
-                    url = url.strip()
-                    if url:
-                        save_url_to_vectordb_user(
-                            username, url, user_docs,
-                            crawl_links=crawl_links,
-                            page_limit=page_limit
-                        )
-                st.success("✅ All valid URLs processed.")
+                urls = [
+                    url.strip() for url in st.session_state.get(f'url_inputs_{username}', [""])
+                    if url.strip()
+                ]
+                if urls:
+                    get_ingest_queue().enqueue(username, "urls", {
+                        "urls": urls,
+                        "crawl_links": crawl_links,
+                        "page_limit": int(page_limit)
+                    })
+                    st.success(f"✅ Queued {len(urls)} URL(s) for processing.")
 
             # User-specific reset
             if st.button("🗑️ Reset My Data", use_container_width=True):
@@ -185,18 +182,39 @@ class ChatApp:
                     self.reset_user_data(username)
 
         # Vector store and chat for user
-        all_user_docs = get_user_documents(username)
         user_vectordb_key = f'vectordb_{username}'
-
-        if (user_vectordb_key not in st.session_state or
-                has_new_files_user(username, all_user_docs)):
-
-            with st.spinner(f"Updating {username}'s knowledge base..."):
-                try:
-                    st.session_state[user_vectordb_key] = get_vectorstore_user(username, all_user_docs)
-                    st.success("✅ Knowledge base updated.")
-                except Exception as e:
-                    st.error(f"Error updating vector store: {e}")
+        ingest_queue = get_ingest_queue()
+
+        index_mismatch = False
+        if user_vectordb_key not in st.session_state:
+            try:
+                st.session_state[user_vectordb_key] = open_vectorstore_user(username)
+            except IndexMismatchError as e:
+                index_mismatch = True
+                st.error(str(e))
+                # Re-embed the archived chunks with the configured model
+                if not ingest_queue.has_active_jobs(username) and st.button(
+                        "♻️ Rebuild knowledge base", key=f"rebuild_{username}"):
+                    ingest_queue.enqueue(username, "rebuild")
+                    st.rerun()
+            except Exception as e:
+                st.error(f"Error opening vector store: {e}")
+
+        # Ingestion runs in the background worker; chat keeps using the
+        # last committed index in the meantime. An ingest into a store
+        # built by another model would only fail, and failed ingests are
+        # retried with a growing delay instead of on every rerun.
+        if not index_mismatch and has_new_files_user(username) and not ingest_queue.has_active_jobs(username):
+            backoff = ingest_queue.ingest_backoff(username)
+            if not backoff:
+                ingest_queue.enqueue(username, "ingest")
+            else:
+                st.warning(f"⚠️ Indexing failed, retrying automatically in {int(backoff) + 1}s.")
+                if st.button("🔁 Retry now", key=f"retry_ingest_{username}"):
+                    ingest_queue.enqueue(username, "ingest")
+                    st.rerun()
+
+        self._render_ingestion_status(username)
 
         # Chat interface
         if user_vectordb_key in st.session_state:
@@ -206,7 +224,8 @@ class ChatApp:
 
             st.session_state[chat_history_key] = chat(
                 st.session_state[chat_history_key],
-                st.session_state[user_vectordb_key]
+                st.session_state[user_vectordb_key],
+                persist_dir=get_user_dirs(username)['vectordb']
             )
         else:
             st.info("Upload documents or enter URLs to begin chatting.")
@@ -217,6 +236,56 @@ class ChatApp:
         st.session_state[f'uploaded_urls_{username}'] = []
         st.session_state[f'url_inputs_{username}'] = [""]
         st.session_state[f'chat_history_{username}'] = []
+        # Không hiển thị lại thông báo của các job đã xong trước khi đăng nhập
+        st.session_state[f'seen_jobs_{username}'] = {
+            job['id'] for job in get_ingest_queue().user_jobs(username)
+            if job['status'] not in ('queued', 'running')
+        }
+
+    def _render_ingestion_status(self, username):
+        """Show background ingestion progress, polling while jobs are active"""
+        jobs = get_ingest_queue().user_jobs(username)
+        active = any(job['status'] in ('queued', 'running') for job in jobs)
+
+        fragment = getattr(st, "fragment", None)
+        if active and fragment is not None:
+            fragment(run_every=2)(self._render_job_progress)(username)
+        else:
+            self._render_job_progress(username)
+            if active and st.button("🔄 Refresh status", key=f"refresh_jobs_{username}"):
+                st.rerun()
+
+    def _render_job_progress(self, username):
+        """Render per-job, per-file progress and the messages of finished jobs"""
+        seen_key = f'seen_jobs_{username}'
+        seen = st.session_state.setdefault(seen_key, set())
+        jobs = get_ingest_queue().user_jobs(username)
+        was_active = st.session_state.get(f'jobs_active_{username}', False)
+        active = False
+
+        for job in reversed(jobs):
+            if job['status'] in ('queued', 'running'):
+                active = True
+                stages = job['progress']
+                done = sum(1 for stage in stages.values() if stage == 'done')
+                label = f"⏳ {job['kind'].capitalize()} job #{job['id']} ({job['status']})"
+                if stages:
+                    label += f" — {done}/{len(stages)} done"
+                with st.expander(label):
+                    for name, stage in stages.items():
+                        st.write(f"`{stage}` {name}")
+                    for level, message in job['messages'][-5:]:
+                        st.caption(message)
+            elif job['id'] not in seen:
+                for level, message in job['messages']:
+                    if level in ('success', 'warning', 'error'):
+                        getattr(st, level)(message)
+                seen.add(job['id'])
+
+        st.session_state[f'jobs_active_{username}'] = active
+        if was_active and not active:
+            # Jobs just finished: rerun the whole page to refresh the document list
+            st.rerun()
 
     def _handle_url_inputs_user(self, username):
         """Handle URL inputs for specific user"""
@@ -253,6 +322,10 @@ class ChatApp:
 
     def reset_user_data(self, username):
         """Reset all data for specific user"""
+        # A running job would write the manifest and indexes back after cleanup
+        if not get_ingest_queue().cancel_user(username, timeout=RESET_JOB_TIMEOUT):
+            st.error("⏳ A background job is still finishing, please try the reset again in a moment.")
+            return
         cleanup_user_data(username)
 
         # Clear user-specific session state
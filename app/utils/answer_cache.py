@@ -0,0 +1,125 @@
+# utils/answer_cache.py
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# --- Constants ---
+ANSWER_CACHE_THRESHOLD   = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))   # cosine similarity
+ANSWER_CACHE_TTL         = float(os.getenv("ANSWER_CACHE_TTL", str(24 * 3600)))  # seconds
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "256"))     # per store
+
+
+class _Entry:
+    __slots__ = ("vector", "query", "answer", "sources", "version", "created")
+
+    def __init__(self, vector, query, answer, sources, version):
+        self.vector = vector
+        self.query = query
+        self.answer = answer
+        self.sources = sources
+        self.version = version
+        self.created = time.time()
+
+
+class AnswerCache:
+    """
+    Semantic cache of generated answers, one LRU per vector store.
+
+    A question is a hit when its embedding is within `threshold` cosine
+    similarity of a cached question asked against the same index version
+    and the entry is younger than `ttl`. Any ingestion or deletion bumps
+    the index version, which drops the store's older entries on the next
+    lookup. Entries keep the answer text and its source Documents.
+    """
+
+    def __init__(
+        self,
+        threshold: float = ANSWER_CACHE_THRESHOLD,
+        ttl: float = ANSWER_CACHE_TTL,
+        max_entries: int = ANSWER_CACHE_MAX_ENTRIES
+    ):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._stores = {}   # store key -> OrderedDict[int, _Entry]
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalise(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _live(self, store: str, version: int) -> OrderedDict:
+        """The store's entries, minus those of older index versions or past their TTL."""
+        entries = self._stores.setdefault(store, OrderedDict())
+        now = time.time()
+        for key in [k for k, e in entries.items() if e.version != version or now - e.created > self.ttl]:
+            del entries[key]
+        return entries
+
+    def lookup(self, store: str, version: int, vector) -> Optional[Tuple[str, List]]:
+        """(answer, source Documents) of the closest cached question, or None."""
+        vector = self._normalise(vector)
+        with self._lock:
+            entries = self._live(store, version)
+            best_key, best_score = None, self.threshold
+            for key, entry in entries.items():
+                if entry.vector.shape != vector.shape:
+                    continue
+                score = float(entry.vector @ vector)
+                if score >= best_score:
+                    best_key, best_score = key, score
+            if best_key is None:
+                self.misses += 1
+                return None
+            entries.move_to_end(best_key)
+            self.hits += 1
+            entry = entries[best_key]
+            return entry.answer, entry.sources
+
+    def put(self, store: str, version: int, vector, query: str, answer: str, sources: List) -> None:
+        with self._lock:
+            entries = self._live(store, version)
+            entries[self._next_id] = _Entry(self._normalise(vector), query, answer, list(sources), version)
+            self._next_id += 1
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def clear(self, store: str = None) -> None:
+        with self._lock:
+            if store is None:
+                self._stores.clear()
+            else:
+                self._stores.pop(store, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": sum(len(e) for e in self._stores.values()),
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> AnswerCache:
+    """Return the process-wide answer cache."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = AnswerCache()
+        return _cache
@@ -1,6 +1,8 @@
 # utils/chatbot.py
 
 import os
+import re
+import threading
 import streamlit as st
 from collections import defaultdict
 from dotenv import load_dotenv
@@ -12,55 +14,118 @@ from langchain_core.messages import AIMessage, HumanMessage
 from langchain_core.outputs import ChatGenerationChunk
 from langchain.chains import create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
-
-
-def get_context_retriever_chain(vectordb, callbacks=None):
+from langchain_core.runnables import RunnableLambda
+
+from .retrieval import get_retriever
+from .index_meta import index_version
+from .answer_cache import get_answer_cache
+from .embedding_backends import get_embedding_backend
+from .retrieval_cache import embed_query_cached
+from .conversation_memory import ConversationMemory
+from .context_packer import pack_context
+
+
+# --- Constants ---
+CHAT_MODEL       = os.getenv("CHAT_MODEL", "gemini-2.0-flash")
+CHAT_TEMPERATURE = float(os.getenv("CHAT_TEMPERATURE", "0.1"))
+
+SYSTEM_PROMPT = "You are a chatbot. You'll receive a prompt that includes a chat history and retrieved content from the vectorDB based on the user's question. Your task is to respond to the user's question using the information from the vectordb, relying as little as possible on your own knowledge. If for some reason you don't know the answer for the question, or the question cannot be answered because there's no context, ask the user for more details. Do not invent an answer, or mention about the knowledge base. Answer the questions from this context: {context}"
+
+_llms = {}
+_llms_lock = threading.Lock()
+_chains = {}   # (store key, index version, model settings) -> chain
+_chains_lock = threading.Lock()
+
+
+def _get_llm(model: str, temperature: float):
+    """One chat model client (and its HTTP connections) per model settings, shared by all users."""
+    key = (model, temperature)
+    with _llms_lock:
+        if key not in _llms:
+            load_dotenv()
+            # Use OpenAI's GPT-4o-mini via LangChain wrapper
+            # llm = ChatOpenAI(
+            #     model="gpt-4o-mini",
+            #     temperature=0.1,
+            #     streaming=True,
+            #     openai_api_key=st.secrets["OPENAI_API_KEY"]
+            # )
+            _llms[key] = ChatGoogleGenerativeAI(
+                model=model,
+                temperature=temperature,
+                streaming=True,
+                google_api_key=os.getenv('GEMINI_API_KEY')
+            )
+        return _llms[key]
+
+
+def get_context_retriever_chain(vectordb, callbacks=None, persist_dir=None):
     """
-    Create a context retriever chain for generating responses using ChatGPT-4o-mini.
+    Return the retrieval chain for a vector store, built once and reused.
+
+    Chains are cached per store (its directory, or the object when the
+    directory is unknown), index version and model settings, so a question
+    does not pay for client, prompt and chain construction. Sessions that
+    opened the same store share one chain; index versions are never
+    reused, so a chain never outlives the store contents it was built on.
+    `callbacks` is ignored: pass them per call in the invoke/stream config
+    so the shared chain stays clean.
+
+    The chain retrieves with the optional "search_query" input (a
+    standalone rewrite of the question) and falls back to "input", then
+    packs the retrieved chunks into the CONTEXT_TOKENS budget.
     """
-    load_dotenv()
-
-    # Use OpenAI's GPT-4o-mini via LangChain wrapper
-    # llm = ChatOpenAI(
-    #     model="gpt-4o-mini",
-    #     temperature=0.1,
-    #     streaming=callbacks is not None,
-    #     callbacks=callbacks,
-    #     openai_api_key=st.secrets["OPENAI_API_KEY"]
-    # )
-
-    llm = ChatGoogleGenerativeAI(
-        model="gemini-2.0-flash",
-        temperature=0.1,
-        streaming=True,
-        google_api_key=os.getenv('GEMINI_API_KEY')
-    )
-
-    retriever = vectordb.as_retriever()
-
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "You are a chatbot. You'll receive a prompt that includes a chat history and retrieved content from the vectorDB based on the user's question. Your task is to respond to the user's question using the information from the vectordb, relying as little as possible on your own knowledge. If for some reason you don't know the answer for the question, or the question cannot be answered because there's no context, ask the user for more details. Do not invent an answer, or mention about the knowledge base. Answer the questions from this context: {context}"),
-        MessagesPlaceholder(variable_name="chat_history"),
-        ("human", "{input}")
-    ])
-
-    chain = create_stuff_documents_chain(llm=llm, prompt=prompt)
-    retrieval_chain = create_retrieval_chain(retriever, chain)
-    return retrieval_chain
-
-def get_response(question, chat_history, vectordb):
+    store = persist_dir or id(vectordb)
+    version = index_version(persist_dir) if persist_dir else 0
+    settings = (CHAT_MODEL, CHAT_TEMPERATURE)
+    key = (store, version, settings)
+
+    with _chains_lock:
+        cached = _chains.get(key)
+        if cached is not None:
+            return cached
+        # Drop chains built for older versions or settings of this store
+        for stale in [k for k in _chains if k[0] == store]:
+            del _chains[stale]
+
+        llm = _get_llm(*settings)
+        # Dense + BM25 when the store's directory is known
+        retriever = get_retriever(vectordb, persist_dir)
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", SYSTEM_PROMPT),
+            MessagesPlaceholder(variable_name="chat_history"),
+            ("human", "{input}")
+        ])
+
+        chain = create_stuff_documents_chain(llm=llm, prompt=prompt)
+        def retrieve(inputs):
+            query = inputs.get("search_query") or inputs["input"]
+            return pack_context(retriever.invoke(query), query)
+
+        retrieval_chain = create_retrieval_chain(RunnableLambda(retrieve), chain)
+        _chains[key] = retrieval_chain
+        return retrieval_chain
+
+def get_response(question, chat_history, vectordb, persist_dir=None, memory=None):
     """
     Generate a response using GPT-4o-mini based on the user question and retrieved context.
+    Pass the session's ConversationMemory to bound the history sent to the model.
     """
-    chain = get_context_retriever_chain(vectordb)
-    response = chain.invoke({"input": question, "chat_history": chat_history})
+    chain = get_context_retriever_chain(vectordb, persist_dir=persist_dir)
+    inputs = {"input": question, "chat_history": chat_history}
+    if memory is not None:
+        llm = _get_llm(CHAT_MODEL, CHAT_TEMPERATURE)
+        inputs["chat_history"] = memory.window(chat_history, llm)
+        inputs["search_query"] = memory.standalone_query(question, inputs["chat_history"], llm)
+    response = chain.invoke(inputs)
     
     # Fix key access for documents
     return response.get("answer") or response.get("result"), response.get("context") or response.get("source_documents")
 
-def chat(chat_history, vectordb):
+def chat(chat_history, vectordb, persist_dir=None):
     """
     Main Streamlit chat interface using GPT-4o-mini and vector context.
+    `persist_dir` is the store's directory, which enables hybrid retrieval.
     """
     user_query = st.chat_input("Ask a question:")
 
@@ -95,48 +160,58 @@ def chat(chat_history, vectordb):
         with st.chat_message("Human"):
             st.write(user_query)
 
-        # Setup LLM
-        # llm = ChatOpenAI(
-        #     model="gpt-4o-mini",
-        #     temperature=0.1,
-        #     streaming=True
-        #     # openai_api_key=st.secrets["OPENAI_API_KEY"]  # Remove for now, fix separately
-        # )
-        llm = ChatGoogleGenerativeAI(
-            model="gemini-2.0-flash",
-            temperature=0.1,
-            streaming=True,
-            google_api_key=os.getenv('GEMINI_API_KEY')
-        )
-
-        retriever = vectordb.as_retriever()
-
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", "You are a chatbot. You'll receive a prompt that includes a chat history and retrieved content from the vectorDB based on the user's question. Your task is to respond to the user's question using the information from the vectordb, relying as little as possible on your own knowledge. If for some reason you don't know the answer for the question, or the question cannot be answered because there's no context, ask the user for more details. Do not invent an answer, or mention about the knowledge base. Answer the questions from this context: {context}"),
-            MessagesPlaceholder(variable_name="chat_history"),
-            ("human", "{input}")
-        ])
-
-        chain = create_stuff_documents_chain(llm=llm, prompt=prompt)
-        retrieval_chain = create_retrieval_chain(retriever, chain)
+        # Recent turns verbatim, older ones summarised, plus a standalone
+        # rewrite of the question for retrieval and caching
+        memory = st.session_state.setdefault(f"chat_memory_{persist_dir or id(vectordb)}", ConversationMemory())
+        if chat_history:
+            llm = _get_llm(CHAT_MODEL, CHAT_TEMPERATURE)
+            history = memory.window(chat_history, llm)
+            search_query = memory.standalone_query(user_query, history, llm)
+        else:
+            # Nothing to summarise or resolve: look the raw question up in
+            # the answer cache before any LLM call
+            history, search_query = [], user_query
+
+        # Repeated questions are answered from the semantic answer cache
+        answer_cache = get_answer_cache()
+        version = index_version(persist_dir) if persist_dir else None
+        query_vector = None
+        cached = None
+        if persist_dir:
+            # Memoised: the retriever reuses this embedding for the same question
+            query_vector = embed_query_cached(get_embedding_backend()[1], search_query)
+            cached = answer_cache.lookup(persist_dir, version, query_vector)
 
         # Create a new AI chat bubble and stream the response
         final_response = ""
+        context = []
         with st.chat_message("AI"):
-            def stream_response():
-                nonlocal final_response
-                for chunk in retrieval_chain.stream({
-                    "input": user_query,
-                    "chat_history": chat_history
-                }):
-                    content = ""
-                    if isinstance(chunk, dict):
-                        content = chunk.get("answer") or chunk.get("result") or ""
-                    elif isinstance(chunk, ChatGenerationChunk):
-                        content = chunk.text
-                    final_response += content
-                    yield content
-            st.write_stream(stream_response)
+            if cached is not None:
+                final_response = cached[0]
+                st.write_stream(iter(re.findall(r"\S+\s*", final_response)))
+            else:
+                # Built once per store and index version, shared with get_response
+                retrieval_chain = get_context_retriever_chain(vectordb, persist_dir=persist_dir)
+
+                def stream_response():
+                    nonlocal final_response, context
+                    for chunk in retrieval_chain.stream({
+                        "input": user_query,
+                        "search_query": search_query,
+                        "chat_history": history
+                    }):
+                        content = ""
+                        if isinstance(chunk, dict):
+                            context = chunk.get("context") or context
+                            content = chunk.get("answer") or chunk.get("result") or ""
+                        elif isinstance(chunk, ChatGenerationChunk):
+                            content = chunk.text
+                        final_response += content
+                        yield content
+                st.write_stream(stream_response)
+
+                if persist_dir and final_response.strip():
+                    answer_cache.put(persist_dir, version, query_vector, search_query, final_response, context)
 
         # Update chat_history with both user and AI messages
         chat_history = chat_history + [
@@ -0,0 +1,149 @@
+# utils/chunk_index.py
+
+import os
+import hashlib
+from typing import Dict, Iterable, List
+
+from .sqlite_db import connect
+
+# --- Constants ---
+CHUNK_INDEX_FILE = "chunk_index.sqlite3"
+
+
+class ChunkIndex:
+    """
+    Per-store index from source file to the Chroma IDs of its chunks, and
+    from chunk content hash to the vector already holding that content.
+
+    Lives next to the Chroma data and is written at insertion time, so a
+    document can be deleted or replaced with targeted Chroma deletes and a
+    chunk identical to one ingested in an earlier batch is not embedded
+    again. A chunk shared by several files is only reported as removable
+    once no file references it any more.
+    """
+
+    def __init__(self, persist_dir: str):
+        self.path = os.path.join(persist_dir, CHUNK_INDEX_FILE)
+        os.makedirs(persist_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS doc_chunks ("
+                " source TEXT NOT NULL,"
+                " chunk_id TEXT NOT NULL,"
+                " PRIMARY KEY (source, chunk_id))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS doc_chunks_id ON doc_chunks (chunk_id)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunk_hashes ("
+                " hash TEXT PRIMARY KEY,"
+                " chunk_id TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS chunk_hashes_id ON chunk_hashes (chunk_id)")
+
+    def _connect(self):
+        return connect(self.path)
+
+    def is_empty(self) -> bool:
+        """True when either table has never been populated."""
+        with self._connect() as conn:
+            return (
+                conn.execute("SELECT 1 FROM doc_chunks LIMIT 1").fetchone() is None or
+                conn.execute("SELECT 1 FROM chunk_hashes LIMIT 1").fetchone() is None
+            )
+
+    def lookup(self, hashes: Iterable[str]) -> Dict[str, str]:
+        """Map the already stored content hashes among `hashes` to their chunk IDs."""
+        unique = list(dict.fromkeys(hashes))
+        found = {}
+        with self._connect() as conn:
+            # Stay below SQLite's bound-parameter limit
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                marks = ",".join("?" * len(batch))
+                found.update(conn.execute(
+                    f"SELECT hash, chunk_id FROM chunk_hashes WHERE hash IN ({marks})", batch
+                ).fetchall())
+        return found
+
+    def add_hashes(self, hash_to_id: Dict[str, str]) -> None:
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO chunk_hashes (hash, chunk_id) VALUES (?, ?)",
+                list(hash_to_id.items())
+            )
+
+    def add(self, source: str, chunk_ids: Iterable[str]) -> None:
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO doc_chunks (source, chunk_id) VALUES (?, ?)",
+                [(source, cid) for cid in chunk_ids]
+            )
+
+    def chunk_ids(self, source: str) -> List[str]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT chunk_id FROM doc_chunks WHERE source = ?", (source,)).fetchall()
+        return [r[0] for r in rows]
+
+    def sources(self) -> List[str]:
+        with self._connect() as conn:
+            return [r[0] for r in conn.execute("SELECT DISTINCT source FROM doc_chunks")]
+
+    def remove_source(self, source: str) -> List[str]:
+        """
+        Forget a source and return the chunk IDs no other source still
+        references, i.e. the vectors that can be deleted from Chroma.
+        """
+        with self._connect() as conn:
+            orphans = [r[0] for r in conn.execute(
+                "SELECT chunk_id FROM doc_chunks WHERE source = ? AND chunk_id NOT IN"
+                " (SELECT chunk_id FROM doc_chunks WHERE source != ?)",
+                (source, source)
+            )]
+            conn.execute("DELETE FROM doc_chunks WHERE source = ?", (source,))
+            conn.executemany("DELETE FROM chunk_hashes WHERE chunk_id = ?", [(cid,) for cid in orphans])
+        return orphans
+
+    def owners(self, chunk_ids: Iterable[str]) -> Dict[str, str]:
+        """One source still referencing each of `chunk_ids` (those with none are left out)."""
+        unique = list(dict.fromkeys(chunk_ids))
+        found = {}
+        with self._connect() as conn:
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                marks = ",".join("?" * len(batch))
+                found.update(conn.execute(
+                    f"SELECT chunk_id, MIN(source) FROM doc_chunks WHERE chunk_id IN ({marks}) GROUP BY chunk_id",
+                    batch
+                ).fetchall())
+        return found
+
+    def clear(self) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM doc_chunks")
+            conn.execute("DELETE FROM chunk_hashes")
+
+    def backfill(self, vectordb, page_size: int = 1000) -> int:
+        """
+        Populate the index of a store built before it existed, from the
+        `source` metadata and the text Chroma holds for every vector.
+        """
+        doc_rows = []
+        hash_rows = []
+        offset = 0
+        while True:
+            page = vectordb.get(limit=page_size, offset=offset, include=["metadatas", "documents"])
+            ids = page.get("ids") or []
+            if not ids:
+                break
+            metadatas = page.get("metadatas") or [{}] * len(ids)
+            documents = page.get("documents") or [""] * len(ids)
+            for cid, meta, text in zip(ids, metadatas, documents):
+                src = (meta or {}).get("source", "")
+                doc_rows.append((os.path.basename(src), cid))
+                hash_rows.append((hashlib.sha256((text or "").encode("utf-8")).hexdigest(), cid))
+            offset += len(ids)
+        with self._connect() as conn:
+            conn.executemany("INSERT OR IGNORE INTO doc_chunks (source, chunk_id) VALUES (?, ?)", doc_rows)
+            conn.executemany("INSERT OR IGNORE INTO chunk_hashes (hash, chunk_id) VALUES (?, ?)", hash_rows)
+        return len(doc_rows)
+
@@ -0,0 +1,226 @@
+# utils/chunk_store.py
+
+import os
+import json
+import mmap
+import threading
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from langchain.docstore.document import Document
+
+from .sqlite_db import connect
+
+# --- Constants ---
+CHUNK_ARCHIVE_FILE = "chunks.jsonl"
+CHUNK_OFFSETS_FILE = "chunks.idx.sqlite3"
+COMPACT_DEAD_RATIO = 0.5   # rewrite the archive once half of it is dead records
+LOCATION_KEYS      = ("page", "sheet", "section")   # where in its source file a chunk sits
+
+_path_locks = {}
+_path_locks_guard = threading.Lock()
+
+
+def _lock_for(path: str) -> threading.Lock:
+    with _path_locks_guard:
+        return _path_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+def repoint_metadata(metadata: dict, source: str) -> dict:
+    """
+    Metadata of a chunk moved to file `source` when only another file's
+    copy is known: same folder, and no page/sheet/section, which
+    described the other file.
+    """
+    moved = {k: v for k, v in metadata.items() if k not in LOCATION_KEYS}
+    moved["source"] = os.path.join(os.path.dirname(metadata.get("source", "")), source)
+    return moved
+
+
+class ChunkStore:
+    """
+    Append-only archive of every chunk written to a store.
+
+    Chunks are JSON lines in `chunks.jsonl`; a SQLite offset index maps
+    (chunk ID, source) to the byte range of the record, so single chunks
+    can be read with one memory-mapped slice and a source's chunks can be
+    listed without scanning. A chunk shared by several sources gets a
+    record per source, carrying that source's metadata, so removing one of
+    them leaves the others' citations intact. Removing a source only drops
+    index rows; the dead records are reclaimed by `compact()` once they
+    make up COMPACT_DEAD_RATIO of the file.
+    """
+
+    def __init__(self, chunks_dir: str):
+        self.chunks_dir = chunks_dir
+        self.archive_path = os.path.join(chunks_dir, CHUNK_ARCHIVE_FILE)
+        self.index_path = os.path.join(chunks_dir, CHUNK_OFFSETS_FILE)
+        self._lock = _lock_for(self.archive_path)
+        os.makedirs(chunks_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                " chunk_id TEXT NOT NULL,"
+                " source TEXT NOT NULL,"
+                " offset INTEGER NOT NULL,"
+                " length INTEGER NOT NULL,"
+                " PRIMARY KEY (chunk_id, source))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS chunks_source ON chunks (source)")
+
+    def _connect(self):
+        return connect(self.index_path)
+
+    # --- Writing ---
+    def append(self, source: str, chunks: Iterable[Tuple[str, Document]]) -> int:
+        """Append (chunk ID, Document) pairs for `source`. Returns the number written."""
+        rows = []
+        with self._lock:
+            with self._connect() as conn:
+                stored = {}
+                with open(self.archive_path, "ab") as f:
+                    offset = f.tell()
+                    for chunk_id, doc in chunks:
+                        if chunk_id in stored:
+                            rows.append((chunk_id, source, *stored[chunk_id]))
+                            continue
+                        existing = conn.execute(
+                            "SELECT offset, length FROM chunks WHERE chunk_id = ? AND source = ?",
+                            (chunk_id, source)
+                        ).fetchone()
+                        if existing:
+                            # Re-appended unchanged for the same source
+                            stored[chunk_id] = existing
+                            rows.append((chunk_id, source, *existing))
+                            continue
+                        record = json.dumps(
+                            {"id": chunk_id, "source": source, "text": doc.page_content, "metadata": doc.metadata},
+                            ensure_ascii=False
+                        ).encode("utf-8") + b"\n"
+                        f.write(record)
+                        stored[chunk_id] = (offset, len(record))
+                        rows.append((chunk_id, source, offset, len(record)))
+                        offset += len(record)
+                conn.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def remove_source(self, source: str) -> List[str]:
+        """Drop a source from the index; returns its chunk IDs."""
+        with self._lock, self._connect() as conn:
+            ids = [r[0] for r in conn.execute("SELECT chunk_id FROM chunks WHERE source = ?", (source,))]
+            conn.execute("DELETE FROM chunks WHERE source = ?", (source,))
+        self._maybe_compact()
+        return ids
+
+    def adopt(self, source: str, chunk_ids: Iterable[str]) -> Dict[str, Document]:
+        """
+        The Documents of `chunk_ids` as `source` holds them, e.g. to
+        re-point a shared chunk at `source` after the file it was first
+        stored for is removed. Records written for another file (archives
+        from before records were kept per source) are rewritten for
+        `source` with repoint_metadata.
+        """
+        with self._connect() as conn:
+            rows = []
+            for chunk_id in dict.fromkeys(chunk_ids):
+                row = conn.execute(
+                    "SELECT offset, length FROM chunks WHERE chunk_id = ? AND source = ?", (chunk_id, source)
+                ).fetchone()
+                if row:
+                    rows.append((chunk_id, row))
+        docs, stale = {}, []
+        for (chunk_id, _), record in zip(rows, self._read([span for _, span in rows])):
+            if record.get("source", source) != source:
+                record["metadata"] = repoint_metadata(record["metadata"], source)
+                stale.append((chunk_id, self._to_document(record)))
+            docs[chunk_id] = self._to_document(record)
+        if stale:
+            with self._lock, self._connect() as conn:
+                conn.executemany(
+                    "DELETE FROM chunks WHERE chunk_id = ? AND source = ?", [(cid, source) for cid, _ in stale]
+                )
+            self.append(source, stale)
+        return docs
+
+    def clear(self) -> None:
+        with self._lock:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM chunks")
+            if os.path.exists(self.archive_path):
+                os.remove(self.archive_path)
+
+    # --- Reading ---
+    def _read(self, spans: List[Tuple[int, int]]) -> Iterator[dict]:
+        if not spans or not os.path.exists(self.archive_path) or os.path.getsize(self.archive_path) == 0:
+            return
+        with open(self.archive_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for offset, length in spans:
+                yield json.loads(mm[offset:offset + length])
+
+    @staticmethod
+    def _to_document(record: dict) -> Document:
+        return Document(page_content=record["text"], metadata=record["metadata"])
+
+    def get(self, chunk_ids: List[str]) -> Dict[str, Document]:
+        """Random access by chunk ID."""
+        with self._connect() as conn:
+            spans = {}
+            for chunk_id in dict.fromkeys(chunk_ids):
+                row = conn.execute(
+                    "SELECT offset, length FROM chunks WHERE chunk_id = ? LIMIT 1", (chunk_id,)
+                ).fetchone()
+                if row:
+                    spans[chunk_id] = row
+        records = self._read(list(spans.values()))
+        return {chunk_id: self._to_document(record) for chunk_id, record in zip(spans, records)}
+
+    def sources(self) -> List[str]:
+        with self._connect() as conn:
+            return [r[0] for r in conn.execute("SELECT DISTINCT source FROM chunks ORDER BY source")]
+
+    def iter_source(self, source: str) -> Iterator[Tuple[str, Document]]:
+        """(chunk ID, Document) pairs of one source, in archive order."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT chunk_id, offset, length FROM chunks WHERE source = ? ORDER BY offset", (source,)
+            ).fetchall()
+        for (chunk_id, _, _), record in zip(rows, self._read([(o, l) for _, o, l in rows])):
+            yield chunk_id, self._to_document(record)
+
+    def is_empty(self) -> bool:
+        with self._connect() as conn:
+            return conn.execute("SELECT 1 FROM chunks LIMIT 1").fetchone() is None
+
+    # --- Maintenance ---
+    def _maybe_compact(self) -> None:
+        if not os.path.exists(self.archive_path):
+            return
+        total = os.path.getsize(self.archive_path)
+        with self._connect() as conn:
+            live = conn.execute(
+                "SELECT COALESCE(SUM(length), 0) FROM (SELECT DISTINCT offset, length FROM chunks)"
+            ).fetchone()[0]
+        if total and (total - live) / total >= COMPACT_DEAD_RATIO:
+            self.compact()
+
+    def compact(self) -> None:
+        """Rewrite the archive with only the records still referenced."""
+        with self._lock:
+            with self._connect() as conn:
+                spans = conn.execute(
+                    "SELECT DISTINCT offset, length FROM chunks ORDER BY offset"
+                ).fetchall()
+                tmp_path = self.archive_path + ".compact"
+                moved = {}
+                with open(tmp_path, "wb") as out:
+                    if spans:
+                        with open(self.archive_path, "rb") as f, \
+                                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                            for offset, length in spans:
+                                moved[offset] = out.tell()
+                                out.write(mm[offset:offset + length])
+                conn.executemany(
+                    "UPDATE chunks SET offset = ? WHERE offset = ?",
+                    # Offsets only move down, so update in ascending order
+                    [(new, old) for old, new in sorted(moved.items())]
+                )
+                os.replace(tmp_path, self.archive_path)
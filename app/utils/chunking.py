@@ -0,0 +1,109 @@
+# utils/chunking.py
+
+import os
+from typing import Dict, List
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain.docstore.document import Document
+
+# --- Constants ---
+CHUNK_TOKENS         = int(os.getenv("CHUNK_TOKENS", "512"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "64"))
+TOKEN_ENCODING       = "cl100k_base"
+
+# Per source type: chunk size and overlap in tokens, and the separators
+# tried in order so splits land on the natural boundaries of the format.
+# Documents are never merged across pages, sheets or docx sections: the
+# loaders emit one Document per page/sheet/section and chunks stay inside.
+CHUNKING_PROFILES: Dict[str, dict] = {
+    "pdf":   {"chunk_tokens": CHUNK_TOKENS, "overlap_tokens": CHUNK_OVERLAP_TOKENS,
+              "separators": ["\n\n", "\n", ". ", " ", ""]},
+    "docx":  {"chunk_tokens": CHUNK_TOKENS, "overlap_tokens": CHUNK_OVERLAP_TOKENS,
+              "separators": ["\n\n", "\n", ". ", " ", ""]},
+    "excel": {"chunk_tokens": CHUNK_TOKENS, "overlap_tokens": 0,
+              "separators": ["\n", " ", ""]},      # whole rows
+    "html":  {"chunk_tokens": CHUNK_TOKENS, "overlap_tokens": CHUNK_OVERLAP_TOKENS,
+              "separators": ["\n\n", "\n", ". ", " ", ""]},   # paragraphs from extract_all_visible_text
+    "text":  {"chunk_tokens": CHUNK_TOKENS, "overlap_tokens": CHUNK_OVERLAP_TOKENS,
+              "separators": ["\n\n", "\n", ". ", " ", ""]},
+}
+
+_encoding = None
+
+
+def _get_encoding():
+    """Load the tiktoken encoding on first use; False when unavailable."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+        except Exception:
+            # tiktoken missing or its encoding file not downloadable offline
+            _encoding = False
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    # ~4 characters per token is close enough for budgeting
+    return max(1, len(text) // 4) if text else 0
+
+
+def source_type(doc: Document) -> str:
+    """Map a Document to its chunking profile by the extension of its source."""
+    src = doc.metadata.get("source", "").lower()
+    if src.endswith(".pdf"):
+        return "pdf"
+    if src.endswith((".docx", ".doc")):
+        return "docx"
+    if src.endswith((".xls", ".xlsx")):
+        return "excel"
+    if src.endswith(".html.txt"):
+        return "html"
+    return "text"
+
+
+_splitters = {}
+
+
+def _splitter(kind: str, profiles: Dict[str, dict]) -> RecursiveCharacterTextSplitter:
+    profile = profiles.get(kind, profiles["text"])
+    key = (kind, profile["chunk_tokens"], profile["overlap_tokens"], tuple(profile["separators"]))
+    if key not in _splitters:
+        _splitters[key] = RecursiveCharacterTextSplitter(
+            chunk_size=profile["chunk_tokens"],
+            chunk_overlap=profile["overlap_tokens"],
+            separators=profile["separators"],
+            length_function=count_tokens,
+        )
+    return _splitters[key]
+
+
+def split_documents(docs: List[Document], profiles: Dict[str, dict] = None) -> List[Document]:
+    """Split each Document with the token-measured profile of its source type."""
+    profiles = profiles or CHUNKING_PROFILES
+    chunks = []
+    for doc in docs:
+        chunks.extend(_splitter(source_type(doc), profiles).split_documents([doc]))
+    return chunks
+
+
+def chunking_signature(profiles: Dict[str, dict] = None) -> dict:
+    """
+    The settings that determine chunk boundaries. Stored in the index
+    metadata so a store built with different settings gets rebuilt.
+    """
+    profiles = profiles or CHUNKING_PROFILES
+    return {
+        # The configured encoding, not whether it loaded: a flaky download
+        # must not trigger a rebuild
+        "tokenizer": TOKEN_ENCODING,
+        "profiles": {
+            kind: {"chunk_tokens": p["chunk_tokens"], "overlap_tokens": p["overlap_tokens"],
+                   "separators": list(p["separators"])}
+            for kind, p in sorted(profiles.items())
+        },
+    }
@@ -0,0 +1,119 @@
+# utils/context_packer.py
+
+import os
+import re
+import unicodedata
+from typing import List
+
+from langchain_core.documents import Document
+
+from .chunking import count_tokens
+from .lexical_index import tokenize_vi
+
+# --- Constants ---
+CONTEXT_TOKENS     = int(os.getenv("CONTEXT_TOKENS", "3000"))        # budget for {context}
+CONTEXT_EXTRACTIVE = os.getenv("CONTEXT_EXTRACTIVE", "0") == "1"     # keep only query-relevant sentences
+MIN_OVERLAP_CHARS  = 20
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?;:])\s+|\n+")
+# Metadata that places a chunk inside its file: chunks are only merged within one unit
+_UNIT_KEYS = ("source", "page", "sheet", "section")
+
+
+def _unit(doc: Document) -> tuple:
+    return tuple(doc.metadata.get(k) for k in _UNIT_KEYS)
+
+
+def _normalise(text: str) -> str:
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip().lower()
+
+
+def _merge_overlap(a: str, b: str):
+    """`a` followed by `b` if b starts with a suffix of a (the splitter's overlap), else None."""
+    head = b[:MIN_OVERLAP_CHARS]
+    if len(head) < MIN_OVERLAP_CHARS:
+        return None
+    start = a.find(head)
+    while start != -1:
+        tail = a[start:]
+        if b.startswith(tail):
+            return a + b[len(tail):]
+        start = a.find(head, start + 1)
+    return None
+
+
+def merge_adjacent(docs: List[Document]) -> List[Document]:
+    """
+    Merge chunks of the same page/sheet/section whose texts overlap, and
+    drop chunks whose text is already contained in a kept one. Rank order
+    is kept: a merged chunk takes the place of the better ranked part.
+    """
+    kept: List[Document] = []
+    for doc in docs:
+        text = doc.page_content
+        norm = _normalise(text)
+        if not norm or any(norm in _normalise(k.page_content) for k in kept):
+            continue
+        for i, k in enumerate(kept):
+            if _unit(k) != _unit(doc):
+                continue
+            merged = _merge_overlap(k.page_content, text) or _merge_overlap(text, k.page_content)
+            if merged is not None:
+                kept[i] = Document(page_content=merged, metadata=dict(k.metadata))
+                break
+        else:
+            kept.append(doc)
+    return kept
+
+
+def select_sentences(text: str, query: str, budget: int) -> str:
+    """
+    The sentences of `text` sharing the most terms with `query`, in their
+    original order, within `budget` tokens. Empty when nothing matches.
+    """
+    query_terms = set(tokenize_vi(query))
+    sentences = [s for s in _SENTENCE_RE.split(text) if s.strip()]
+    scored = []
+    for i, sentence in enumerate(sentences):
+        terms = set(tokenize_vi(sentence))
+        score = len(terms & query_terms) / (1 + len(terms)) ** 0.5
+        if score > 0:
+            scored.append((score, i))
+
+    chosen, used = set(), 0
+    for score, i in sorted(scored, reverse=True):
+        cost = count_tokens(sentences[i])
+        if used + cost <= budget:
+            chosen.add(i)
+            used += cost
+    return " ".join(sentences[i].strip() for i in sorted(chosen))
+
+
+def pack_context(
+    docs: List[Document],
+    query: str,
+    budget: int = CONTEXT_TOKENS,
+    extractive: bool = CONTEXT_EXTRACTIVE
+) -> List[Document]:
+    """
+    Fit retrieved chunks into `budget` tokens before they are stuffed into
+    the prompt: merge overlapping neighbours, drop duplicates, then take
+    chunks in rank order. With `extractive`, every chunk is reduced to its
+    query-relevant sentences; otherwise only a chunk that no longer fits
+    whole is. Chunk metadata (source, page, ...) is kept for citations.
+    """
+    packed, used = [], 0
+    for doc in merge_adjacent(docs):
+        remaining = budget - used
+        if remaining <= 0:
+            break
+        text = doc.page_content
+        cost = count_tokens(text)
+        if extractive or cost > remaining:
+            text = select_sentences(text, query, remaining)
+            if not text:
+                continue
+            cost = count_tokens(text)
+        packed.append(Document(page_content=text, metadata=dict(doc.metadata)))
+        used += cost
+    return packed
@@ -0,0 +1,115 @@
+# utils/conversation_memory.py
+
+import os
+from collections import OrderedDict
+from typing import List
+
+from langchain_core.messages import AIMessage, BaseMessage, SystemMessage
+
+from .chunking import count_tokens
+
+# --- Constants ---
+CHAT_HISTORY_TURNS  = int(os.getenv("CHAT_HISTORY_TURNS", "4"))       # question/answer pairs kept verbatim
+CHAT_HISTORY_TOKENS = int(os.getenv("CHAT_HISTORY_TOKENS", "1500"))   # summary + verbatim turns
+SUMMARY_TOKENS      = 300
+REWRITE_CACHE_SIZE  = 32                                               # memoised standalone rewrites
+
+SUMMARY_PROMPT = (
+    "Progressively summarize a conversation between a user and an assistant. "
+    "Extend the current summary with the new lines, keeping names, numbers, "
+    "document references and open questions, in the language of the conversation "
+    "and under {limit} words. Return only the new summary.\n\n"
+    "Current summary:\n{summary}\n\nNew lines:\n{lines}"
+)
+REWRITE_PROMPT = (
+    "Given the conversation below and a follow-up question, rewrite the follow-up "
+    "as a standalone search query that can be understood without the conversation. "
+    "Resolve pronouns and references, keep codes and names exactly, use the "
+    "language of the question, and return only the query.\n\n"
+    "Conversation:\n{history}\n\nFollow-up question: {question}"
+)
+
+
+def _format(messages: List[BaseMessage]) -> str:
+    lines = []
+    for message in messages:
+        role = "Assistant" if isinstance(message, AIMessage) else (
+            "Summary" if isinstance(message, SystemMessage) else "User"
+        )
+        lines.append(f"{role}: {message.content}")
+    return "\n".join(lines)
+
+
+class ConversationMemory:
+    """
+    Bounded view of a chat history for the LLM.
+
+    The last CHAT_HISTORY_TURNS turns are kept verbatim; older messages
+    are folded, a few at a time as they leave the window, into a running
+    summary. Verbatim turns are trimmed further when summary plus turns
+    would exceed CHAT_HISTORY_TOKENS, so the prompt size stays flat however
+    long the session runs. The full history stays with the caller (for
+    display); this object only holds the summary and how far it reaches.
+    """
+
+    def __init__(self, max_turns: int = CHAT_HISTORY_TURNS, max_tokens: int = CHAT_HISTORY_TOKENS):
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.summary = ""
+        self.summarized = 0   # number of leading chat_history messages in the summary
+        self._rewrites = OrderedDict()   # (question, formatted window) -> standalone query
+
+    def _fold(self, messages: List[BaseMessage], llm) -> bool:
+        try:
+            response = llm.invoke(SUMMARY_PROMPT.format(
+                limit=SUMMARY_TOKENS, summary=self.summary or "(empty)", lines=_format(messages)
+            ))
+        except Exception:
+            # Keep the messages verbatim and retry on the next turn
+            return False
+        self.summary = response.content.strip()
+        return True
+
+    def window(self, chat_history: List[BaseMessage], llm) -> List[BaseMessage]:
+        """Messages to send as chat_history: the summary, then the recent turns."""
+        if self.summarized > len(chat_history):
+            # History was reset
+            self.summary, self.summarized = "", 0
+
+        keep_from = max(self.summarized, len(chat_history) - 2 * self.max_turns)
+        budget = self.max_tokens - min(count_tokens(self.summary), SUMMARY_TOKENS * 2)
+        while keep_from < len(chat_history) and \
+                sum(count_tokens(m.content) for m in chat_history[keep_from:]) > budget:
+            keep_from += 2   # whole question/answer pairs
+        keep_from = min(keep_from, len(chat_history))
+
+        if keep_from > self.summarized and self._fold(chat_history[self.summarized:keep_from], llm):
+            self.summarized = keep_from
+        messages = list(chat_history[self.summarized:])
+        if self.summary:
+            messages.insert(0, SystemMessage(content=f"Summary of the earlier conversation: {self.summary}"))
+        return messages
+
+    def standalone_query(self, question: str, window: List[BaseMessage], llm) -> str:
+        """
+        A self-contained search query for `question`, resolved against the
+        windowed history. Rewrites are memoised per question and window, so
+        asking the same thing again at the same point costs no LLM call.
+        """
+        if not window:
+            return question
+        history = _format(window)
+        key = (question, history)
+        if key in self._rewrites:
+            self._rewrites.move_to_end(key)
+            return self._rewrites[key]
+        try:
+            response = llm.invoke(REWRITE_PROMPT.format(history=history, question=question))
+        except Exception:
+            # Not memoised, so the next attempt calls the model again
+            return question
+        query = response.content.strip() or question
+        self._rewrites[key] = query
+        if len(self._rewrites) > REWRITE_CACHE_SIZE:
+            self._rewrites.popitem(last=False)
+        return query
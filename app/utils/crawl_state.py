@@ -0,0 +1,119 @@
+# utils/crawl_state.py
+
+import os
+import json
+import time
+from typing import Dict, List, Optional
+
+from .sqlite_db import connect
+
+# --- Constants ---
+CRAWL_STATE_FILE = "crawl_state.sqlite3"
+
+
+class CrawlState:
+    """
+    What a user's crawls last saw of each URL: the file it was saved as,
+    its ETag and Last-Modified validators, the hash of the saved content
+    and its outgoing links; plus an audit log of the URLs crawls skipped
+    as duplicates, and why.
+
+    Recrawls send the validators as conditional request headers, so an
+    unchanged page costs a 304 with no body, and follow the stored links
+    of such pages to keep walking the site. A page whose body comes back
+    with the same content hash is not rewritten either, so only changed
+    pages reach the docs folder and get re-embedded.
+    """
+
+    def __init__(self, state_dir: str):
+        self.path = os.path.join(state_dir, CRAWL_STATE_FILE)
+        os.makedirs(state_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                " url TEXT PRIMARY KEY,"
+                " fname TEXT,"
+                " etag TEXT,"
+                " last_modified TEXT,"
+                " content_hash TEXT,"
+                " links TEXT NOT NULL DEFAULT '[]',"
+                " fetched REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS pages_fname ON pages (fname)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS skips ("
+                " url TEXT PRIMARY KEY,"
+                " reason TEXT NOT NULL,"
+                " detail TEXT NOT NULL DEFAULT '{}',"
+                " at REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        return connect(self.path)
+
+    def get(self, url: str) -> Optional[dict]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT fname, etag, last_modified, content_hash, links, fetched FROM pages WHERE url = ?",
+                (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "fname": row[0], "etag": row[1], "last_modified": row[2],
+            "content_hash": row[3], "links": json.loads(row[4]), "fetched": row[5],
+        }
+
+    def owner(self, fname: str) -> Optional[str]:
+        """The URL a saved file was recorded for, if any."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT url FROM pages WHERE fname = ? LIMIT 1", (fname,)).fetchone()
+        return row[0] if row else None
+
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        """If-None-Match / If-Modified-Since for a URL fetched before."""
+        page = self.get(url)
+        headers = {}
+        if page and page["content_hash"]:
+            if page["etag"]:
+                headers["If-None-Match"] = page["etag"]
+            if page["last_modified"]:
+                headers["If-Modified-Since"] = page["last_modified"]
+        return headers
+
+    def record(
+        self,
+        url: str,
+        fname: Optional[str],
+        etag: Optional[str],
+        last_modified: Optional[str],
+        content_hash: Optional[str],
+        links: List[str] = None
+    ) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO pages (url, fname, etag, last_modified, content_hash, links, fetched)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, fname, etag, last_modified, content_hash, json.dumps(links or []), time.time())
+            )
+
+    def touch(self, url: str) -> None:
+        """Mark a URL as confirmed unchanged (a 304)."""
+        with self._connect() as conn:
+            conn.execute("UPDATE pages SET fetched = ? WHERE url = ?", (time.time(), url))
+
+    def record_skip(self, url: str, reason: str, **detail) -> None:
+        """Log why a URL was not fetched or saved (latest decision per URL)."""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO skips (url, reason, detail, at) VALUES (?, ?, ?, ?)",
+                (url, reason, json.dumps(detail, ensure_ascii=False), time.time())
+            )
+
+    def skips(self, limit: int = 100) -> List[dict]:
+        """Most recent skip decisions, newest first."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT url, reason, detail, at FROM skips ORDER BY at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [{"url": r[0], "reason": r[1], "detail": json.loads(r[2]), "at": r[3]} for r in rows]
@@ -0,0 +1,329 @@
+# utils/crawler.py
+
+import os
+import time
+import hashlib
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import contextmanager
+from typing import Callable, Iterable, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# --- Constants ---
+CRAWL_WORKERS    = int(os.getenv("CRAWL_WORKERS", "8"))
+CRAWL_PER_HOST   = int(os.getenv("CRAWL_PER_HOST", "4"))           # concurrent requests per host
+CRAWL_HOST_DELAY = float(os.getenv("CRAWL_HOST_DELAY", "0.1"))     # seconds between request starts per host
+CRAWL_TIMEOUT    = 10
+USER_AGENT       = "Mozilla/5.0 (compatible; TNTBot/1.0)"
+
+# Downloads stream to disk; larger documents are abandoned
+MAX_DOWNLOAD_BYTES = {
+    "pdf":  int(os.getenv("CRAWL_MAX_PDF_BYTES", str(50 * 1024 * 1024))),
+    "html": int(os.getenv("CRAWL_MAX_HTML_BYTES", str(5 * 1024 * 1024))),
+}
+MAX_DECOMPRESSION_RATIO = int(os.getenv("CRAWL_MAX_DECOMPRESSION_RATIO", "100"))  # decoded / wire bytes
+DOWNLOAD_CHUNK          = 64 * 1024
+SNIFF_BYTES             = 1024
+# Types that are never worth downloading, whatever the body starts with
+SKIP_CONTENT_TYPES = ("image/", "audio/", "video/", "font/", "application/zip", "application/gzip",
+                      "application/x-tar", "application/x-rar", "application/x-7z", "application/x-msdownload",
+                      "application/vnd.", "application/msword", "application/java-archive")
+OPAQUE_CONTENT_TYPES = ("", "application/octet-stream", "binary/octet-stream", "application/download")
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml", "text/plain", "application/xml", "text/xml")
+
+
+class HostThrottle:
+    """
+    Per-host politeness: at most `per_host` requests in flight to one host
+    and at least `delay` seconds between the starts of two requests to it.
+    """
+
+    def __init__(self, per_host: int = CRAWL_PER_HOST, delay: float = CRAWL_HOST_DELAY):
+        self.per_host = per_host
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._slots = {}        # host -> Semaphore
+        self._next_start = {}   # host -> monotonic time of the next allowed start
+
+    @contextmanager
+    def slot(self, host: str):
+        with self._lock:
+            semaphore = self._slots.setdefault(host, threading.Semaphore(self.per_host))
+        with semaphore:
+            with self._lock:
+                now = time.monotonic()
+                start = max(now, self._next_start.get(host, now))
+                self._next_start[host] = start + self.delay
+            if start > now:
+                time.sleep(start - now)
+            yield
+
+
+# Shared by every crawl in the process, so concurrent crawls of one site
+# (e.g. two users) are throttled together
+_throttle = HostThrottle()
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_http_session() -> requests.Session:
+    """
+    Process-wide keep-alive session for crawling, with a connection pool
+    large enough for every crawl worker and a couple of retries on
+    transient errors.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            session.headers["User-Agent"] = USER_AGENT
+            adapter = HTTPAdapter(
+                pool_connections=CRAWL_WORKERS,
+                pool_maxsize=CRAWL_WORKERS * 2,
+                max_retries=Retry(total=2, backoff_factor=0.5, status_forcelist=(502, 503, 504),
+                                  allowed_methods=("GET", "HEAD")),
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+
+def fetch(url: str, throttle: Optional[HostThrottle] = None, **kwargs) -> requests.Response:
+    """GET through the shared session, inside the host's politeness slot."""
+    throttle = throttle or _throttle
+    with throttle.slot(urlparse(url).netloc):
+        resp = get_http_session().get(url, timeout=CRAWL_TIMEOUT, **kwargs)
+    resp.raise_for_status()
+    return resp
+
+
+class DownloadRejected(Exception):
+    """A response abandoned before or during download, for `reason` ("content_type", "too_large", ...)."""
+
+    def __init__(self, url: str, reason: str, detail: str = ""):
+        super().__init__(f"{reason}: {detail}" if detail else reason)
+        self.url = url
+        self.reason = reason
+        self.detail = detail
+
+
+class Download:
+    """
+    A fetched response whose body was streamed to a temp file.
+
+    Carries what callers need from the response (status, headers,
+    encoding) plus the sniffed `kind` ("pdf" or "html"), byte `size` and
+    `sha256` of the decoded body. The temp file lives next to its final
+    destination, so `commit` is an atomic rename; `discard` removes it if
+    it was not committed. A 304 has no body and no file.
+    """
+
+    def __init__(self, url: str, resp: requests.Response):
+        self.url = url
+        # Where the body actually came from, after redirects: the base for relative links
+        self.final_url = resp.url or url
+        self.status_code = resp.status_code
+        self.headers = resp.headers
+        self.encoding = resp.encoding
+        self.kind: Optional[str] = None
+        self.path: Optional[str] = None
+        self.size = 0
+        self.sha256: Optional[str] = None
+
+    def read_text(self) -> str:
+        """The body decoded as text; only used for HTML, which is capped small."""
+        with open(self.path, "rb") as f:
+            return f.read().decode(self.encoding or "utf-8", errors="replace")
+
+    def commit(self, dest: str) -> None:
+        os.replace(self.path, dest)
+        self.path = None
+
+    def discard(self) -> None:
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
+
+
+def sniff_kind(url: str, content_type: str, head: bytes) -> Optional[str]:
+    """
+    "pdf", "html" or None (not worth saving) from the Content-Type and the
+    first bytes of the body. Magic bytes win over the header, since
+    servers often label PDFs as octet-stream and error pages as PDFs.
+    """
+    ctype = content_type.split(";")[0].strip().lower()
+    if b"%PDF-" in head[:SNIFF_BYTES]:
+        return "pdf"
+    if b"\x00" in head:
+        return None
+    if ctype in HTML_CONTENT_TYPES or ctype.startswith("text/"):
+        return "html"
+    markup = head.lstrip(b"\xef\xbb\xbf \t\r\n").lower()
+    if ctype in OPAQUE_CONTENT_TYPES or ctype == "application/pdf":
+        if markup.startswith((b"<!doctype", b"<html", b"<?xml", b"<head", b"<body")):
+            return "html"
+    return None
+
+
+def download(
+    url: str,
+    dest_dir: str,
+    throttle: Optional[HostThrottle] = None,
+    max_bytes: dict = None,
+    **kwargs
+) -> Download:
+    """
+    GET `url` and stream the body to a temp file in `dest_dir`, in
+    DOWNLOAD_CHUNK pieces, so memory stays flat whatever the size.
+
+    The response is abandoned with DownloadRejected as soon as it shows
+    it is not wanted: a Content-Type in SKIP_CONTENT_TYPES (before any
+    body is read), first bytes that sniff as neither PDF nor HTML, a
+    Content-Length or a running size over the kind's limit in
+    `max_bytes`, or a compressed body inflating more than
+    MAX_DECOMPRESSION_RATIO times its wire size.
+    """
+    throttle = throttle or _throttle
+    max_bytes = max_bytes or MAX_DOWNLOAD_BYTES
+    with throttle.slot(urlparse(url).netloc):
+        resp = get_http_session().get(url, timeout=CRAWL_TIMEOUT, stream=True, **kwargs)
+        out = None
+        try:
+            resp.raise_for_status()
+            result = Download(url, resp)
+            if resp.status_code == 304:
+                return result
+
+            content_type = resp.headers.get("Content-Type", "")
+            if content_type.split(";")[0].strip().lower().startswith(SKIP_CONTENT_TYPES):
+                raise DownloadRejected(url, "content_type", content_type)
+            length = int(resp.headers.get("Content-Length") or 0)
+            compressed = bool(resp.headers.get("Content-Encoding"))
+
+            digest = hashlib.sha256()
+            for chunk in resp.iter_content(chunk_size=DOWNLOAD_CHUNK):
+                if not chunk:
+                    continue
+                if out is None:
+                    result.kind = sniff_kind(url, content_type, chunk[:SNIFF_BYTES])
+                    if result.kind is None:
+                        raise DownloadRejected(url, "content_type", content_type or "unknown")
+                    limit = max_bytes[result.kind]
+                    if length > limit:
+                        raise DownloadRejected(url, "too_large", f"{length} bytes")
+                    fd, result.path = tempfile.mkstemp(prefix=".download.", suffix=".part", dir=dest_dir)
+                    out = os.fdopen(fd, "wb")
+                result.size += len(chunk)
+                if result.size > limit:
+                    raise DownloadRejected(url, "too_large", f"over {limit} bytes")
+                # Decoded bytes against bytes off the wire: stops gzip bombs early
+                if compressed and result.size > DOWNLOAD_CHUNK and \
+                        result.size > MAX_DECOMPRESSION_RATIO * max(1, resp.raw.tell()):
+                    raise DownloadRejected(url, "decompression", f"{result.size} bytes from {resp.raw.tell()}")
+                digest.update(chunk)
+                out.write(chunk)
+            if out is None:
+                raise DownloadRejected(url, "empty")
+            out.close()
+        except BaseException:
+            if out is not None:
+                out.close()
+                os.remove(result.path)
+            raise
+        finally:
+            resp.close()
+
+    result.sha256 = digest.hexdigest()
+    return result
+
+
+def crawl(
+    start_url: str,
+    handle: Callable[[str, object], Iterable[str]],
+    page_limit: int = 50,
+    follow: bool = True,
+    workers: int = CRAWL_WORKERS,
+    on_fetch: Callable[[str, int], None] = None,
+    on_error: Callable[[str, Exception], None] = None,
+    on_limit: Callable[[], None] = None,
+    fetch_page: Callable[[str], object] = None,
+    canonicalize: Callable[[str], str] = None,
+    on_skip: Callable[[str, str], None] = None
+) -> int:
+    """
+    Breadth-first crawl from `start_url`.
+
+    Pages are fetched by a pool of `workers` threads through the shared
+    keep-alive session and a per-host throttle; `handle(url, response)`
+    runs on the calling thread, one page at a time, with what `fetch_page`
+    returned (a Response from `fetch`, or a Download), and returns the links
+    to follow. At most `page_limit` URLs are fetched: the budget is spent
+    when a URL is scheduled, not when it returns, so concurrent workers
+    cannot overshoot it.
+
+    URLs are deduplicated by their `canonicalize`d form, so variants of
+    one page are fetched once; `on_skip(url, canonical)` reports each
+    variant dropped that way. `fetch_page` gets the URL as linked, while
+    `handle`, `on_error` and the other callbacks get the canonical form,
+    which callers use as the page's key.
+
+    `on_fetch(url, n)` is called as the n-th URL is scheduled, `on_error`
+    for failed fetches and `on_limit` once if links are left unvisited
+    because the budget ran out. Returns the number of URLs fetched.
+    """
+    fetch_page = fetch_page or fetch
+    canonicalize = canonicalize or (lambda url: url)
+    start_key = canonicalize(start_url)
+    frontier = deque([(start_key, start_url)])
+    seen = {start_key}
+    variants = set()
+    scheduled = 0
+    limit_hit = False
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="crawl") as pool:
+        in_flight = {}
+        while frontier or in_flight:
+            while frontier and len(in_flight) < workers:
+                if scheduled >= page_limit:
+                    if not limit_hit and on_limit:
+                        on_limit()
+                    limit_hit = True
+                    frontier.clear()
+                    break
+                key, url = frontier.popleft()
+                scheduled += 1
+                if on_fetch:
+                    on_fetch(key, scheduled)
+                in_flight[pool.submit(fetch_page, url)] = key
+
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                url = in_flight.pop(future)
+                try:
+                    resp = future.result()
+                except Exception as e:
+                    if on_error:
+                        on_error(url, e)
+                    continue
+                links = handle(url, resp) or []
+                if follow:
+                    for link in links:
+                        canonical = canonicalize(link)
+                        if canonical not in seen:
+                            seen.add(canonical)
+                            frontier.append((canonical, link))
+                        elif canonical != link and link not in variants:
+                            variants.add(link)
+                            if on_skip:
+                                on_skip(link, canonical)
+    return scheduled
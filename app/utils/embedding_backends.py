@@ -0,0 +1,111 @@
+# utils/embedding_backends.py
+
+import os
+import re
+import hashlib
+import threading
+import unicodedata
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from .embedding_cache import CachedEmbeddings, get_embedding_store
+from .embedding_dispatch import BatchEmbedder, get_rate_limiter
+
+# --- Constants ---
+EMBEDDING_BACKEND   = os.getenv("EMBEDDING_BACKEND", "google")
+GOOGLE_EMBED_MODEL  = os.getenv("GOOGLE_EMBED_MODEL", "models/embedding-001")
+HASHING_DIM         = int(os.getenv("HASHING_EMBED_DIM", "768"))
+HASHING_NGRAMS      = (3, 5)   # character n-gram range
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Dependency-light local embeddings: signed feature hashing of word
+    unigrams/bigrams and character n-grams into a fixed-size, L2
+    normalised vector. No model download, no network, deterministic
+    across processes, and fast enough for offline benchmarks.
+    """
+
+    def __init__(self, dim: int = HASHING_DIM, ngrams: Tuple[int, int] = HASHING_NGRAMS):
+        self.dim = dim
+        self.ngrams = ngrams
+
+    @property
+    def model_id(self) -> str:
+        return f"hashing:d{self.dim}:c{self.ngrams[0]}-{self.ngrams[1]}"
+
+    def _features(self, text: str):
+        text = unicodedata.normalize("NFC", text).lower()
+        words = re.findall(r"\w+", text)
+        for word in words:
+            yield "w:" + word
+        for a, b in zip(words, words[1:]):
+            yield f"b:{a} {b}"
+        lo, hi = self.ngrams
+        for word in words:
+            padded = f" {word} "
+            for n in range(lo, hi + 1):
+                for i in range(len(padded) - n + 1):
+                    yield "c:" + padded[i:i + n]
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature in self._features(text):
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            h = int.from_bytes(digest, "little")
+            vector[h % self.dim] += 1.0 if (h >> 63) & 1 else -1.0
+        # Dampen frequent features, then normalise for cosine/L2 search
+        vector = np.sign(vector) * np.log1p(np.abs(vector))
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+def _google_backend() -> Tuple[str, Embeddings]:
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+    embedding = GoogleGenerativeAIEmbeddings(
+        model=GOOGLE_EMBED_MODEL,
+        google_api_key=os.getenv('GEMINI_API_KEY')
+    )
+    # Cache misses go out in quota-aware concurrent batches
+    embedding = BatchEmbedder(embedding, get_rate_limiter())
+    return GOOGLE_EMBED_MODEL, CachedEmbeddings(embedding, GOOGLE_EMBED_MODEL, get_embedding_store())
+
+
+def _hashing_backend() -> Tuple[str, Embeddings]:
+    embedding = HashingEmbeddings()
+    return embedding.model_id, embedding
+
+
+# name -> factory returning (model id recorded in the store, Embeddings)
+EMBEDDING_BACKENDS: Dict[str, Callable[[], Tuple[str, Embeddings]]] = {
+    "google": _google_backend,
+    "hashing": _hashing_backend,
+}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_embedding_backend(name: str = None) -> Tuple[str, Embeddings]:
+    """
+    Return (model id, embedding function) for the configured backend,
+    built once per process. Select with the EMBEDDING_BACKEND env var.
+    """
+    name = name or EMBEDDING_BACKEND
+    if name not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{name}'. Choose one of: {', '.join(EMBEDDING_BACKENDS)}")
+    with _backends_lock:
+        if name not in _backends:
+            _backends[name] = EMBEDDING_BACKENDS[name]()
+        return _backends[name]
@@ -0,0 +1,129 @@
+# utils/embedding_cache.py
+
+import os
+import sqlite3
+import hashlib
+import threading
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# --- Constants ---
+DEFAULT_EMBEDDING_CACHE_PATH = "cache/embeddings.sqlite3"
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    SQLite table of float32 vectors keyed by (model, text hash).
+
+    One connection is shared by every thread in the process and guarded
+    by a lock; vectors are stored as raw float32 blobs.
+    """
+
+    def __init__(self, path: str = DEFAULT_EMBEDDING_CACHE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " model TEXT NOT NULL,"
+                " hash TEXT NOT NULL,"
+                " vector BLOB NOT NULL,"
+                " PRIMARY KEY (model, hash))"
+            )
+
+    def get_many(self, model: str, hashes: List[str]) -> dict:
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            # Stay below SQLite's bound-parameter limit
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                marks = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({marks})",
+                    [model, *batch]
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def put_many(self, model: str, items: dict) -> None:
+        rows = [(model, h, np.asarray(v, dtype=np.float32).tobytes()) for h, v in items.items()]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)", rows)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that only sends texts it has never seen before to
+    the underlying model. Works for both document and query embeddings and
+    keeps hit/miss counters for monitoring.
+    """
+
+    def __init__(self, underlying: Embeddings, model_name: str, store: EmbeddingStore):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [_text_hash(t) for t in texts]
+        found = self.store.get_many(self.model_name, hashes)
+
+        missing = {}
+        for h, text in zip(hashes, texts):
+            if h not in found and h not in missing:
+                missing[h] = text
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            new = dict(zip(missing.keys(), vectors))
+            self.store.put_many(self.model_name, new)
+            found.update(new)
+        return [list(found[h]) for h in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        # Query vectors may differ from document vectors (task type), so
+        # they live under their own model key.
+        key = f"{self.model_name}#query"
+        h = _text_hash(text)
+        found = self.store.get_many(key, [h])
+        if h in found:
+            self.hits += 1
+            return found[h]
+        self.misses += 1
+        vector = self.underlying.embed_query(text)
+        self.store.put_many(key, {h: vector})
+        return list(vector)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_embedding_store(path: str = DEFAULT_EMBEDDING_CACHE_PATH) -> EmbeddingStore:
+    """Return the process-wide embedding store for `path`."""
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = EmbeddingStore(path)
+        return _stores[path]
@@ -0,0 +1,117 @@
+# utils/embedding_dispatch.py
+
+import os
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+# --- Constants ---
+EMBED_BATCH_SIZE      = int(os.getenv("EMBED_BATCH_SIZE", "100"))      # texts per request (Gemini batch limit)
+EMBED_CONCURRENCY     = int(os.getenv("EMBED_CONCURRENCY", "4"))       # requests in flight per call
+EMBED_TEXTS_PER_MIN   = float(os.getenv("EMBED_TEXTS_PER_MIN", "1500"))  # process-wide quota
+EMBED_MAX_RETRIES     = int(os.getenv("EMBED_MAX_RETRIES", "5"))
+EMBED_BACKOFF_SECONDS = 1.0
+
+# Exception names / message fragments that mean "try again later"
+_RETRYABLE_NAMES = ("ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "DeadlineExceeded",
+                    "InternalServerError", "Timeout", "ConnectionError")
+_RETRYABLE_TEXT  = ("429", "quota", "rate limit", "resource exhausted", "503", "unavailable", "timed out")
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` tokens per second, bursts of up to
+    `capacity` tokens.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, n: float = 1) -> None:
+        """Block until `n` tokens are available, then take them."""
+        n = min(n, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= n:
+                    self._tokens -= n
+                    return
+                wait = (n - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def _is_retryable(error: Exception) -> bool:
+    name = type(error).__name__
+    text = str(error).lower()
+    return any(n in name for n in _RETRYABLE_NAMES) or any(t in text for t in _RETRYABLE_TEXT)
+
+
+class BatchEmbedder(Embeddings):
+    """
+    Embeddings wrapper that packs texts into provider-sized batches, sends
+    up to `concurrency` batches at once, and charges every text to a
+    token bucket shared by all sessions in the process. Quota and
+    transient errors are retried with exponential backoff and jitter.
+    """
+
+    def __init__(
+        self,
+        underlying: Embeddings,
+        limiter: TokenBucket,
+        batch_size: int = EMBED_BATCH_SIZE,
+        concurrency: int = EMBED_CONCURRENCY,
+        max_retries: int = EMBED_MAX_RETRIES
+    ):
+        self.underlying = underlying
+        self.limiter = limiter
+        self.batch_size = max(1, batch_size)
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+
+    def _call(self, fn, cost: int):
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire(cost)
+            try:
+                return fn()
+            except Exception as e:
+                if attempt == self.max_retries or not _is_retryable(e):
+                    raise
+                time.sleep(EMBED_BACKOFF_SECONDS * (2 ** attempt) * (1 + random.random()))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        embed = lambda batch: self._call(lambda: self.underlying.embed_documents(batch), len(batch))
+        if len(batches) <= 1 or self.concurrency == 1:
+            results = [embed(batch) for batch in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.concurrency, len(batches))) as executor:
+                results = list(executor.map(embed, batches))
+        return [vector for batch in results for vector in batch]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._call(lambda: self.underlying.embed_query(text), 1)
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> TokenBucket:
+    """The process-wide embedding quota, shared by every session."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            # Burst + refill over any 60 s window never exceeds the quota
+            capacity = min(EMBED_BATCH_SIZE, EMBED_TEXTS_PER_MIN / 2)
+            _limiter = TokenBucket((EMBED_TEXTS_PER_MIN - capacity) / 60.0, capacity)
+        return _limiter
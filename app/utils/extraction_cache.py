@@ -0,0 +1,128 @@
+# utils/extraction_cache.py
+
+import os
+import json
+import hashlib
+import threading
+from typing import List, Optional
+
+from langchain.docstore.document import Document
+
+# --- Constants ---
+DEFAULT_EXTRACT_CACHE_DIR = "cache/extracted"
+EXTRACT_CACHE_MAX_BYTES   = int(os.getenv("EXTRACT_CACHE_MAX_BYTES", str(1024 ** 3)))
+# Bump whenever a loader change alters what extract_text produces
+EXTRACTOR_VERSION         = "3"
+
+
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    """SHA-256 of a file's contents, read in 1 MiB blocks."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class ExtractionCache:
+    """
+    Content-addressed on-disk cache of extracted Documents.
+
+    Entries are keyed by the SHA-256 of the file bytes plus
+    EXTRACTOR_VERSION, so the same file uploaded by another user or under
+    another name is only parsed once. Each entry is one JSON file; reads
+    refresh its mtime and the least recently used entries are evicted
+    once the cache grows past `max_bytes`.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_EXTRACT_CACHE_DIR, max_bytes: int = EXTRACT_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total = None   # bytes on disk, computed on first write
+
+    def _path(self, file_hash: str) -> str:
+        key = f"{file_hash}-v{EXTRACTOR_VERSION}"
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, file_hash: str, source: str) -> Optional[List[Document]]:
+        """Return the cached Documents re-labelled with `source`, or None on a miss."""
+        path = self._path(file_hash)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+            os.utime(path)   # mark as recently used
+        except (OSError, ValueError):
+            return None
+        return [
+            Document(page_content=e["page_content"], metadata={**e["metadata"], "source": source})
+            for e in entries
+        ]
+
+    def put(self, file_hash: str, docs: List[Document]) -> None:
+        """Store the Documents extracted from a file with the given hash."""
+        path = self._path(file_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entries = [{"page_content": d.page_content, "metadata": d.metadata} for d in docs]
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entries, f, ensure_ascii=False)
+            size = os.path.getsize(tmp_path)
+            try:
+                replaced = os.path.getsize(path)   # an existing entry being overwritten
+            except OSError:
+                replaced = 0
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError):
+            # Unserialisable metadata or a full disk: skip caching this file
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        with self._lock:
+            if self._total is None:
+                self._total = self._disk_usage()
+            else:
+                self._total += size - replaced
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".json"):
+                    path = os.path.join(root, name)
+                    try:
+                        st_ = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, st_.st_size, st_.st_mtime
+
+    def _disk_usage(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self) -> None:
+        """Delete least recently used entries until usage is at or below 90% of the cap."""
+        target = int(self.max_bytes * 0.9)
+        for path, size, _ in sorted(self._entries(), key=lambda e: e[2]):
+            if self._total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._total -= size
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_extraction_cache() -> ExtractionCache:
+    """Return the process-wide extraction cache."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ExtractionCache()
+        return _cache
@@ -0,0 +1,71 @@
+# utils/index_meta.py
+
+import os
+import json
+import time
+import threading
+
+from .manifest import atomic_write
+
+# --- Constants ---
+INDEX_META_FILE        = "index_meta.json"
+# Stores built before the metadata file existed all used Gemini
+LEGACY_EMBEDDING_MODEL = "models/embedding-001"
+
+
+_version_lock = threading.Lock()
+
+
+class IndexMismatchError(RuntimeError):
+    """A vector store was opened with settings other than the ones that built it."""
+
+
+def read_index_meta(persist_dir: str) -> dict:
+    path = os.path.join(persist_dir, INDEX_META_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_index_meta(persist_dir: str, meta: dict) -> None:
+    os.makedirs(persist_dir, exist_ok=True)
+    atomic_write(os.path.join(persist_dir, INDEX_META_FILE), json.dumps(meta, indent=2, ensure_ascii=False))
+
+
+def ensure_embedding_model(persist_dir: str, model_id: str, has_vectors: bool) -> None:
+    """
+    Record which embedding model builds the store, or fail loudly if it
+    was built by another one: vectors from different models are not
+    comparable, so searching them would silently return garbage.
+    """
+    meta = read_index_meta(persist_dir)
+    recorded = meta.get("embedding_model")
+    if recorded is None:
+        recorded = LEGACY_EMBEDDING_MODEL if has_vectors else model_id
+        meta["embedding_model"] = recorded
+        write_index_meta(persist_dir, meta)
+    if recorded != model_id:
+        raise IndexMismatchError(
+            f"Vector store '{persist_dir}' was built with embedding model '{recorded}' "
+            f"but the configured model is '{model_id}'. Switch EMBEDDING_BACKEND back "
+            f"or reset the store to rebuild it."
+        )
+
+
+def index_version(persist_dir: str) -> int:
+    """Counter bumped on every change to the store's contents."""
+    return read_index_meta(persist_dir).get("version", 0)
+
+
+def bump_index_version(persist_dir: str) -> int:
+    """
+    Mark the store as changed. Anything cached against the store (chains,
+    answers, retrieval results) is keyed by this version. Versions are
+    time-based so a store deleted and recreated never repeats one.
+    """
+    with _version_lock:
+        meta = read_index_meta(persist_dir)
+        meta["version"] = max(meta.get("version", 0) + 1, time.time_ns())
+        write_index_meta(persist_dir, meta)
+        return meta["version"]
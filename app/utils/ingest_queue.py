@@ -0,0 +1,321 @@
+# utils/ingest_queue.py
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import List, Optional
+
+# --- Constants ---
+DEFAULT_JOBS_DB    = "users/.ingest_jobs.sqlite3"
+INGEST_WORKERS     = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_SLICE_FILES = int(os.getenv("INGEST_SLICE_FILES", "8"))   # files per turn before yielding to other users
+JOB_KINDS          = ("ingest", "urls", "delete", "rebuild")
+ACTIVE_STATUSES    = ("queued", "running")
+INGEST_RETRY_DELAY = float(os.getenv("INGEST_RETRY_DELAY", "30"))     # seconds after the first failure
+INGEST_RETRY_MAX   = float(os.getenv("INGEST_RETRY_MAX", "3600"))     # cap of the doubling backoff
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job once its user cancelled it."""
+
+
+class IngestQueue:
+    """
+    Persistent ingestion job queue with a small pool of worker threads.
+
+    Jobs (ingest, urls, delete, rebuild) are stored in SQLite so they survive
+    browser refreshes and process restarts. Workers pick the next job
+    round-robin across users and never run two jobs of the same user at
+    once, so one user's jobs stay ordered and a large upload, which is
+    processed INGEST_SLICE_FILES files per turn, cannot starve everyone
+    else.
+    """
+
+    def __init__(self, db_path: str = DEFAULT_JOBS_DB, workers: int = INGEST_WORKERS):
+        self.db_path = db_path
+        self.workers = max(1, workers)
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._threads = []
+        self._last_served = {}   # username -> monotonic time of last turn
+        self._cancelling = set()  # ids of running jobs asked to stop
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " username TEXT NOT NULL,"
+                " kind TEXT NOT NULL,"
+                " payload TEXT NOT NULL,"
+                " status TEXT NOT NULL,"
+                " progress TEXT NOT NULL DEFAULT '{}',"
+                " messages TEXT NOT NULL DEFAULT '[]',"
+                " created REAL NOT NULL,"
+                " updated REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, username)")
+            # Jobs interrupted by a restart resume from their last commit
+            self._conn.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'")
+
+    # --- Producer side ---
+    def enqueue(self, username: str, kind: str, payload: Optional[dict] = None) -> int:
+        """Queue a job and return its id. Ingest jobs are coalesced per user."""
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        now = time.time()
+        with self._lock, self._conn:
+            if kind == "ingest":
+                # An ingest job picks up every pending file when it runs
+                row = self._conn.execute(
+                    "SELECT id FROM jobs WHERE username = ? AND kind = 'ingest' AND status = 'queued'",
+                    (username,)
+                ).fetchone()
+                if row:
+                    return row[0]
+            cur = self._conn.execute(
+                "INSERT INTO jobs (username, kind, payload, status, created, updated)"
+                " VALUES (?, ?, ?, 'queued', ?, ?)",
+                (username, kind, json.dumps(payload or {}), now, now)
+            )
+            job_id = cur.lastrowid
+        self.start()
+        self._wakeup.set()
+        return job_id
+
+    def cancel_user(self, username: str, timeout: float = 0.0) -> bool:
+        """
+        Drop every queued job of a user (e.g. on data reset) and ask a
+        running one to stop at its next progress update. Waits up to
+        `timeout` seconds for it to stop; returns False if it is still
+        running, in which case the caller must not touch the user's data.
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'cancelled', updated = ? WHERE username = ? AND status = 'queued'",
+                (time.time(), username)
+            )
+            running = [row[0] for row in self._conn.execute(
+                "SELECT id FROM jobs WHERE username = ? AND status = 'running'", (username,)
+            )]
+            self._cancelling.update(running)
+
+        deadline = time.monotonic() + timeout
+        while self.has_active_jobs(username):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.1)
+        return True
+
+    def ingest_backoff(self, username: str) -> float:
+        """
+        Seconds to wait before queueing another automatic ingest for a
+        user whose last ingest jobs failed; 0 when none did. The delay
+        doubles with each consecutive failure, from INGEST_RETRY_DELAY up
+        to INGEST_RETRY_MAX, so a bad API key or an exhausted quota is not
+        retried on every page refresh.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, updated FROM jobs WHERE username = ? AND kind = 'ingest'"
+                " AND status IN ('done', 'failed') ORDER BY id DESC LIMIT 32",
+                (username,)
+            ).fetchall()
+        failures = 0
+        for status, _ in rows:
+            if status != "failed":
+                break
+            failures += 1
+        if not failures:
+            return 0.0
+        delay = min(INGEST_RETRY_MAX, INGEST_RETRY_DELAY * 2 ** (failures - 1))
+        return max(0.0, rows[0][1] + delay - time.time())
+
+    def user_jobs(self, username: str, limit: int = 5) -> List[dict]:
+        """Active jobs plus the most recent finished ones, newest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, kind, payload, status, progress, messages, created, updated FROM jobs"
+                " WHERE username = ? ORDER BY (status IN ('queued', 'running')) DESC, id DESC LIMIT ?",
+                (username, limit)
+            ).fetchall()
+        return [
+            {
+                "id": r[0], "kind": r[1], "payload": json.loads(r[2]), "status": r[3],
+                "progress": json.loads(r[4]), "messages": json.loads(r[5]),
+                "created": r[6], "updated": r[7],
+            }
+            for r in rows
+        ]
+
+    def has_active_jobs(self, username: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM jobs WHERE username = ? AND status IN ('queued', 'running') LIMIT 1",
+                (username,)
+            ).fetchone()
+        return row is not None
+
+    # --- Worker side ---
+    def start(self) -> None:
+        """Start the worker threads once per process."""
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            for i in range(len(self._threads), self.workers):
+                t = threading.Thread(target=self._work, name=f"ingest-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _claim_next(self) -> Optional[tuple]:
+        """Claim the oldest queued job of the least recently served user."""
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT id, username, kind, payload FROM jobs WHERE status = 'queued'"
+                " AND username NOT IN (SELECT username FROM jobs WHERE status = 'running')"
+                " ORDER BY id"
+            ).fetchall()
+            if not rows:
+                return None
+            first_per_user = {}
+            for row in rows:
+                first_per_user.setdefault(row[1], row)
+            username = min(first_per_user, key=lambda u: self._last_served.get(u, 0.0))
+            job = first_per_user[username]
+            self._last_served[username] = time.monotonic()
+            self._conn.execute(
+                "UPDATE jobs SET status = 'running', updated = ? WHERE id = ?",
+                (time.time(), job[0])
+            )
+        return job[0], job[1], job[2], json.loads(job[3])
+
+    def _update(self, job_id: int, **fields) -> None:
+        sets = ", ".join(f"{k} = ?" for k in fields)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"UPDATE jobs SET {sets}, updated = ? WHERE id = ?",
+                (*fields.values(), time.time(), job_id)
+            )
+
+    def _work(self) -> None:
+        while True:
+            job = self._claim_next()
+            if job is None:
+                self._wakeup.wait(timeout=1.0)
+                self._wakeup.clear()
+                continue
+            self._run(*job)
+
+    def _run(self, job_id: int, username: str, kind: str, payload: dict) -> None:
+        progress = {}
+        messages = []
+
+        def record(level, message):
+            messages.append([level, message])
+            self._update(job_id, messages=json.dumps(messages))
+
+        def check_cancelled():
+            if job_id in self._cancelling:
+                raise JobCancelled()
+
+        def report(level, message):
+            record(level, message)
+            check_cancelled()
+
+        def set_progress(fname, stage):
+            progress[fname] = stage
+            self._update(job_id, progress=json.dumps(progress))
+            check_cancelled()
+
+        with self._lock:
+            row = self._conn.execute("SELECT progress, messages FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        progress.update(json.loads(row[0]))
+        messages.extend(json.loads(row[1]))
+
+        try:
+            status = JOB_RUNNERS[kind](self, username, payload, report, set_progress)
+        except JobCancelled:
+            status = "cancelled"
+        except Exception as e:
+            record("error", f"❌ {kind} job failed for {username}: {e}")
+            status = "failed"
+        with self._lock:
+            if job_id in self._cancelling:
+                self._cancelling.discard(job_id)
+                status = "cancelled"
+        self._update(job_id, status=status)
+        self._wakeup.set()
+
+
+def _run_ingest(queue: IngestQueue, username: str, payload: dict, report, progress) -> str:
+    from .prepare_vectordb import ingest_user_files, get_pending_files_user
+
+    for fname in get_pending_files_user(username):
+        progress(fname, "queued")
+    added, remaining = ingest_user_files(
+        username, report=report, progress=progress, max_files=INGEST_SLICE_FILES
+    )
+    if added:
+        report("success", f"✅ Added {added} unique chunks for {username}")
+    # Requeue the rest so other users get a turn in between
+    return "queued" if remaining else "done"
+
+
+def _run_urls(queue: IngestQueue, username: str, payload: dict, report, progress) -> str:
+    from .save_docs import get_user_documents
+    from .save_urls import save_url_to_vectordb_user
+
+    existing_docs = get_user_documents(username)
+    for url in payload.get("urls", []):
+        progress(url, "fetching")
+        save_url_to_vectordb_user(
+            username, url, existing_docs,
+            crawl_links=payload.get("crawl_links", False),
+            page_limit=payload.get("page_limit", 50),
+            report=report
+        )
+        progress(url, "done")
+    queue.enqueue(username, "ingest")
+    return "done"
+
+
+def _run_delete(queue: IngestQueue, username: str, payload: dict, report, progress) -> str:
+    from .save_docs import delete_user_document
+
+    filename = payload["filename"]
+    progress(filename, "deleting")
+    delete_user_document(username, filename, report=report)
+    progress(filename, "done")
+    return "done"
+
+
+def _run_rebuild(queue: IngestQueue, username: str, payload: dict, report, progress) -> str:
+    from .prepare_vectordb import rebuild_user_vectorstore, get_pending_files_user
+
+    rebuild_user_vectorstore(username, report=report, progress=progress)
+    if get_pending_files_user(username):
+        queue.enqueue(username, "ingest")
+    return "done"
+
+
+JOB_RUNNERS = {
+    "ingest": _run_ingest,
+    "urls": _run_urls,
+    "delete": _run_delete,
+    "rebuild": _run_rebuild,
+}
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_ingest_queue() -> IngestQueue:
+    """Return the process-wide ingestion queue, starting its workers."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = IngestQueue()
+            _queue.start()
+        return _queue
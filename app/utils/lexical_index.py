@@ -0,0 +1,172 @@
+# utils/lexical_index.py
+
+import os
+import re
+import math
+import unicodedata
+from collections import Counter
+from typing import Iterable, List, Tuple
+
+from .sqlite_db import connect
+
+# --- Constants ---
+LEXICAL_INDEX_FILE = "lexical_index.sqlite3"
+BM25_K1            = 1.2
+BM25_B             = 0.75
+
+_CODE_RE = re.compile(r"\w+(?:[./\-]\w+)+")   # 15/2020/NĐ-CP, 3.2.1, ISO-9001
+_WORD_RE = re.compile(r"\w+")
+
+
+def strip_diacritics(text: str) -> str:
+    """Remove Vietnamese tone and vowel marks: 'Nghị định' -> 'Nghi dinh'."""
+    decomposed = unicodedata.normalize("NFD", text)
+    stripped = "".join(c for c in decomposed if unicodedata.category(c) != "Mn")
+    return stripped.replace("đ", "d").replace("Đ", "D")
+
+
+def tokenize_vi(text: str) -> List[str]:
+    """
+    Tokenize Vietnamese (or mixed) text for lexical search.
+
+    Vietnamese words are space-separated syllables, so terms are:
+    - every syllable, NFC-normalised and lower-cased;
+    - its diacritic-free variant prefixed with "~", so queries typed
+      without accents still match (and accented ones match both);
+    - adjacent syllable bigrams ("luật_đất"), which recover compound
+      words and reward phrase matches;
+    - codes kept whole ("15/2020/nđ-cp", "3.2.1"), with their own
+      "~" variant, as well as split.
+    """
+    text = unicodedata.normalize("NFC", text).lower()
+    syllables = _WORD_RE.findall(text)
+    tokens = list(syllables)
+    tokens.extend("~" + strip_diacritics(s) for s in syllables)
+    tokens.extend(f"{a}_{b}" for a, b in zip(syllables, syllables[1:]))
+    codes = _CODE_RE.findall(text)
+    tokens.extend(codes)
+    tokens.extend("~" + strip_diacritics(c) for c in codes)
+    return tokens
+
+
+class BM25Index:
+    """
+    Incremental BM25 inverted index stored next to a Chroma store.
+
+    Postings carry the term frequency and the chunk length, and document
+    frequencies are kept up to date on every add/remove, so a query is
+    one indexed lookup per query term — no scan of the postings and no
+    rebuild after ingestion or deletion.
+    """
+
+    def __init__(self, persist_dir: str):
+        self.path = os.path.join(persist_dir, LEXICAL_INDEX_FILE)
+        os.makedirs(persist_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS postings ("
+                " term TEXT NOT NULL,"
+                " chunk_id TEXT NOT NULL,"
+                " tf INTEGER NOT NULL,"
+                " dl INTEGER NOT NULL,"
+                " PRIMARY KEY (term, chunk_id))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS postings_chunk ON postings (chunk_id)")
+            conn.execute("CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, df INTEGER NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS chunks (chunk_id TEXT PRIMARY KEY, dl INTEGER NOT NULL)")
+
+    def _connect(self):
+        return connect(self.path)
+
+    def is_empty(self) -> bool:
+        with self._connect() as conn:
+            return conn.execute("SELECT 1 FROM chunks LIMIT 1").fetchone() is None
+
+    def add(self, items: Iterable[Tuple[str, str]]) -> int:
+        """Index (chunk ID, text) pairs; already indexed IDs are skipped."""
+        added = 0
+        with self._connect() as conn:
+            for chunk_id, text in items:
+                counts = Counter(tokenize_vi(text or ""))
+                dl = sum(counts.values())
+                if conn.execute(
+                    "INSERT OR IGNORE INTO chunks (chunk_id, dl) VALUES (?, ?)", (chunk_id, dl)
+                ).rowcount == 0:
+                    continue
+                conn.executemany(
+                    "INSERT INTO postings (term, chunk_id, tf, dl) VALUES (?, ?, ?, ?)",
+                    [(term, chunk_id, tf, dl) for term, tf in counts.items()]
+                )
+                conn.executemany(
+                    "INSERT INTO terms (term, df) VALUES (?, 1)"
+                    " ON CONFLICT(term) DO UPDATE SET df = df + 1",
+                    [(term,) for term in counts]
+                )
+                added += 1
+        return added
+
+    def remove(self, chunk_ids: Iterable[str]) -> None:
+        with self._connect() as conn:
+            for chunk_id in chunk_ids:
+                terms = [(r[0],) for r in conn.execute(
+                    "SELECT term FROM postings WHERE chunk_id = ?", (chunk_id,)
+                )]
+                conn.executemany("UPDATE terms SET df = df - 1 WHERE term = ?", terms)
+                conn.execute("DELETE FROM postings WHERE chunk_id = ?", (chunk_id,))
+                conn.execute("DELETE FROM chunks WHERE chunk_id = ?", (chunk_id,))
+            conn.execute("DELETE FROM terms WHERE df <= 0")
+
+    def clear(self) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM postings")
+            conn.execute("DELETE FROM terms")
+            conn.execute("DELETE FROM chunks")
+
+    def search(self, query: str, k: int = 20) -> List[Tuple[str, float]]:
+        """Top `k` (chunk ID, BM25 score) pairs for `query`, best first."""
+        terms = set(tokenize_vi(query))
+        if not terms:
+            return []
+        with self._connect() as conn:
+            n_docs, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(dl), 0) FROM chunks").fetchone()
+            if not n_docs:
+                return []
+            avgdl = total / n_docs
+            marks = ",".join("?" * len(terms))
+            weights = [
+                (term, math.log(1 + (n_docs - df + 0.5) / (df + 0.5)))
+                for term, df in conn.execute(f"SELECT term, df FROM terms WHERE term IN ({marks})", list(terms))
+            ]
+            if not weights:
+                return []
+            # Score in SQLite: one grouped pass over the matching postings
+            values = ",".join("(?, ?)" for _ in weights)
+            return conn.execute(
+                f"WITH q(term, idf) AS (VALUES {values})"
+                " SELECT p.chunk_id, SUM(q.idf * p.tf * ? / (p.tf + ? * (1 - ? + ? * p.dl / ?))) AS score"
+                " FROM q JOIN postings p ON p.term = q.term"
+                " GROUP BY p.chunk_id ORDER BY score DESC LIMIT ?",
+                [x for pair in weights for x in pair]
+                + [BM25_K1 + 1, BM25_K1, BM25_B, BM25_B, avgdl, k]
+            ).fetchall()
+
+    def backfill(self, vectordb, page_size: int = 1000) -> int:
+        """Index every chunk of a store built before the lexical index existed."""
+        added = 0
+        offset = 0
+        while True:
+            page = vectordb.get(limit=page_size, offset=offset, include=["documents"])
+            ids = page.get("ids") or []
+            if not ids:
+                break
+            added += self.add(zip(ids, page.get("documents") or [""] * len(ids)))
+            offset += len(ids)
+        return added
+
+
+def open_lexical_index(vectordb, persist_dir: str) -> BM25Index:
+    """Open the store's BM25 index, backfilling it for stores built before it existed."""
+    index = BM25Index(persist_dir)
+    if index.is_empty() and vectordb.get(limit=1, include=[]).get("ids"):
+        index.backfill(vectordb)
+    return index
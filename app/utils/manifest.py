@@ -0,0 +1,170 @@
+# utils/manifest.py
+
+import os
+import json
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from .extraction_cache import file_sha256
+
+# --- Constants ---
+MANIFEST_FILE   = "manifest.json"
+LEGACY_CACHE    = "files.txt"
+
+
+def atomic_write(path: str, data) -> None:
+    """
+    Write `data` (str or bytes) to `path` through a temp file and a rename.
+
+    Besides never leaving a half-written file behind, the rename updates
+    the directory mtime even when an existing file is overwritten, which
+    is what lets change detection get away with a single directory stat.
+    """
+    directory, name = os.path.split(path)
+    tmp_path = os.path.join(directory, f".{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    mode = "wb" if isinstance(data, bytes) else "w"
+    encoding = None if isinstance(data, bytes) else "utf-8"
+    try:
+        with open(tmp_path, mode, encoding=encoding) as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def list_docs(docs_dir: str) -> List[str]:
+    """Document filenames in `docs_dir`, skipping hidden and temp files."""
+    if not os.path.isdir(docs_dir):
+        return []
+    return sorted(name for name in os.listdir(docs_dir) if not name.startswith("."))
+
+
+def stat_file(path: str, with_hash: bool = True) -> dict:
+    """Size, mtime and (optionally) content hash of a file. Stat first, then hash."""
+    st_ = os.stat(path)
+    info = {"size": st_.st_size, "mtime_ns": st_.st_mtime_ns}
+    if with_hash:
+        info["sha256"] = file_sha256(path)
+    return info
+
+
+class Manifest:
+    """
+    What a vector store was built from: size, mtime and content hash of
+    every committed document.
+
+    Kept in memory and written through to `manifest.json` next to the
+    Chroma data. `version` is bumped on every commit or removal, so
+    callers can cache anything derived from the manifest against it.
+    """
+
+    def __init__(self, persist_dir: str):
+        self.path = os.path.join(persist_dir, MANIFEST_FILE)
+        self._lock = threading.RLock()
+        self.entries: Dict[str, dict] = {}
+        self.version = 0
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.entries = data.get("files", {})
+            self.version = data.get("version", 0)
+
+    def _save(self) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        atomic_write(self.path, json.dumps({"version": self.version, "files": self.entries}, ensure_ascii=False))
+
+    def __contains__(self, fname: str) -> bool:
+        return fname in self.entries
+
+    def commit(self, fname: str, info: dict) -> None:
+        """Record that `fname`, as described by `info`, is fully indexed."""
+        with self._lock:
+            self.entries[fname] = info
+            self.version += 1
+            self._save()
+
+    def forget(self, filenames: List[str]) -> None:
+        with self._lock:
+            dropped = [f for f in filenames if self.entries.pop(f, None) is not None]
+            if dropped:
+                self.version += 1
+                self._save()
+
+    def migrate_files_txt(self, docs_dir: str) -> None:
+        """
+        Seed an empty manifest from a legacy files.txt, trusting that the
+        files listed there are indexed as they are on disk now.
+        """
+        legacy = os.path.join(os.path.dirname(self.path), LEGACY_CACHE)
+        if self.entries or not os.path.exists(legacy):
+            return
+        with open(legacy, "r", encoding="utf-8") as f:
+            names = [line.strip() for line in f if line.strip()]
+        with self._lock:
+            for fname in names:
+                path = os.path.join(docs_dir, fname)
+                if os.path.exists(path):
+                    self.entries[fname] = stat_file(path)
+            self.version += 1
+            self._save()
+
+    def diff(self, docs_dir: str) -> Tuple[List[str], List[str], List[str]]:
+        """
+        Compare the manifest against `docs_dir`.
+
+        Returns (new, modified, removed) filenames. Files whose size or
+        mtime changed are hashed; if the content is actually the same the
+        new stat is recorded without bumping the version.
+        """
+        new, modified = [], []
+        on_disk = list_docs(docs_dir)
+        touched = False
+        with self._lock:
+            for fname in on_disk:
+                entry = self.entries.get(fname)
+                if entry is None:
+                    new.append(fname)
+                    continue
+                path = os.path.join(docs_dir, fname)
+                try:
+                    info = stat_file(path, with_hash=False)
+                except OSError:
+                    continue
+                if info["size"] == entry.get("size") and info["mtime_ns"] == entry.get("mtime_ns"):
+                    continue
+                info["sha256"] = file_sha256(path)
+                if info["sha256"] == entry.get("sha256"):
+                    self.entries[fname] = info
+                    touched = True
+                else:
+                    modified.append(fname)
+            present = set(on_disk)
+            removed = [f for f in self.entries if f not in present]
+            if touched:
+                self._save()
+        return new, modified, removed
+
+
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+
+def get_manifest(persist_dir: str, docs_dir: Optional[str] = None) -> Manifest:
+    """Return the process-wide Manifest of a store, migrating files.txt once."""
+    key = os.path.abspath(persist_dir)
+    with _manifests_lock:
+        manifest = _manifests.get(key)
+        if manifest is None:
+            manifest = Manifest(persist_dir)
+            if docs_dir is not None:
+                manifest.migrate_files_txt(docs_dir)
+            _manifests[key] = manifest
+        return manifest
+
+
+def drop_manifest(persist_dir: str) -> None:
+    """Forget the in-memory manifest of a store that was deleted."""
+    with _manifests_lock:
+        _manifests.pop(os.path.abspath(persist_dir), None)
@@ -0,0 +1,127 @@
+# utils/ocr_pool.py
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# --- Constants ---
+OCR_POOL_SIZE    = int(os.getenv("OCR_POOL_SIZE", "2"))           # engines per language
+OCR_IDLE_TIMEOUT = float(os.getenv("OCR_IDLE_TIMEOUT", "600"))    # seconds
+
+
+def _build_paddleocr(lang: str):
+    """Load the detection, recognition and angle-classifier models once."""
+    from paddleocr import PaddleOCR
+    return PaddleOCR(lang=lang, use_angle_cls=True, show_log=False)
+
+
+class OCREnginePool:
+    """
+    Pool of warm OCR engines keyed by language.
+
+    Engines are built lazily, at most `size` per language, and handed out
+    exclusively so several Streamlit sessions can OCR at once without
+    sharing an engine. Engines left idle for longer than `idle_timeout`
+    seconds are released by a background reaper thread.
+    """
+
+    def __init__(self, size: int = OCR_POOL_SIZE, idle_timeout: float = OCR_IDLE_TIMEOUT, factory=_build_paddleocr):
+        self.size = max(1, size)
+        self.idle_timeout = idle_timeout
+        self.factory = factory
+        self._cond = threading.Condition()
+        self._idle = {}      # lang -> [(engine, last_used), ...]
+        self._created = {}   # lang -> number of live engines
+        self._reaper = None
+
+    @contextmanager
+    def acquire(self, lang: str = 'vi'):
+        """Borrow an engine for `lang`, blocking while all of them are busy."""
+        engine = self._checkout(lang)
+        try:
+            yield engine
+        finally:
+            self._checkin(lang, engine)
+
+    def _checkout(self, lang: str):
+        with self._cond:
+            while True:
+                idle = self._idle.get(lang)
+                if idle:
+                    return idle.pop()[0]
+                if self._created.get(lang, 0) < self.size:
+                    self._created[lang] = self._created.get(lang, 0) + 1
+                    break
+                self._cond.wait()
+
+        # Build outside the lock: loading the models takes seconds
+        try:
+            return self.factory(lang)
+        except Exception:
+            with self._cond:
+                self._created[lang] -= 1
+                self._cond.notify()
+            raise
+
+    def _checkin(self, lang: str, engine) -> None:
+        with self._cond:
+            self._idle.setdefault(lang, []).append((engine, time.monotonic()))
+            self._cond.notify()
+            if self._reaper is None or not self._reaper.is_alive():
+                self._reaper = threading.Thread(target=self._reap, name="ocr-pool-reaper", daemon=True)
+                self._reaper.start()
+
+    def _reap(self) -> None:
+        """Release idle engines until the pool is empty."""
+        interval = max(1.0, min(self.idle_timeout / 2, 60.0))
+        while True:
+            time.sleep(interval)
+            with self._cond:
+                now = time.monotonic()
+                for lang, idle in self._idle.items():
+                    keep = [(e, t) for e, t in idle if now - t < self.idle_timeout]
+                    self._created[lang] -= len(idle) - len(keep)
+                    idle[:] = keep
+                if not any(self._created.values()):
+                    self._reaper = None
+                    return
+
+    def stats(self) -> dict:
+        """Live and idle engine counts per language."""
+        with self._cond:
+            return {
+                lang: {"live": count, "idle": len(self._idle.get(lang, []))}
+                for lang, count in self._created.items()
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_ocr_pool() -> OCREnginePool:
+    """
+    Return the process-wide OCR engine pool, creating it on first use.
+
+    Only the main process OCRs: extraction workers hand scanned pages back
+    to it (see prepare_vectordb._apply_ocr), so at most OCR_POOL_SIZE
+    engines per language are ever loaded.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = OCREnginePool()
+        return _pool
+
+
+def _reset_after_fork() -> None:
+    # A forked extraction worker must not inherit the parent's engines or
+    # a lock that another thread was holding at fork time.
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -5,13 +5,17 @@ nest_asyncio.apply()
 
 import os
 import shutil
-from typing import List
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Tuple
 import streamlit as st
 import hashlib
 import pandas as pd
 import re
 import fitz  # PyMuPDF for PDF image extraction
-from paddleocr import PaddleOCR
 
 from dotenv import load_dotenv
 import chromadb
@@ -22,28 +26,39 @@ from langchain_community.document_loaders import (
     UnstructuredWordDocumentLoader
 )
 from langchain_community.vectorstores import Chroma
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 # from langchain.embeddings import OpenAIEmbeddings
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain.docstore.document import Document
 
+from .ocr_pool import get_ocr_pool, OCR_POOL_SIZE
+from .extraction_cache import get_extraction_cache
+from .embedding_backends import get_embedding_backend
+from .embedding_dispatch import EMBED_BATCH_SIZE, EMBED_CONCURRENCY
+from .index_meta import (
+    ensure_embedding_model, read_index_meta, write_index_meta, bump_index_version, IndexMismatchError
+)
+from .chunking import split_documents, chunking_signature
+from .chunk_index import ChunkIndex
+from .chunk_store import ChunkStore, repoint_metadata
+from .lexical_index import BM25Index, open_lexical_index
+from .answer_cache import get_answer_cache
+from .manifest import Manifest, get_manifest, drop_manifest, stat_file
+
 # --- Constants ---
 DEFAULT_DOCS_DIR    = "docs"
 DEFAULT_PERSIST_DIR = "Vector_DB - Documents"
 DEFAULT_CHUNKS_DIR  = "chunks"
-CHUNK_SIZE          = 8000
-CHUNK_OVERLAP       = 800
+INGEST_BATCH_SIZE   = int(os.getenv("INGEST_BATCH_SIZE", str(EMBED_BATCH_SIZE * EMBED_CONCURRENCY)))
+EXTRACT_WORKERS     = int(os.getenv("EXTRACT_WORKERS", os.cpu_count() or 1))
+OCR_PAGE_WORKERS    = int(os.getenv("OCR_PAGE_WORKERS", OCR_POOL_SIZE))
+CHANGE_CHECK_TTL    = float(os.getenv("CHANGE_CHECK_TTL", "10"))   # seconds
 
 # Load your .env (must contain OPENAI_API_KEY)
 load_dotenv()
 
-def has_new_files(persist_dir: str, current_files: List[str]) -> bool:
-    cache_path = os.path.join(persist_dir, "files.txt")
-    if not os.path.exists(cache_path):
-        return True
-    with open(cache_path, "r", encoding="utf-8") as f:
-        cached_files = set(line.strip() for line in f.readlines())
-    return set(current_files) != cached_files
+def has_new_files(persist_dir: str, current_files: List[str] = None, docs_dir: str = DEFAULT_DOCS_DIR) -> bool:
+    """True when documents were added, modified or removed since the last build."""
+    new, modified, removed = get_manifest(persist_dir, docs_dir).diff(docs_dir)
+    return bool(new or modified or removed)
 
 def is_gibberish(text, threshold=0.3):
     if not text:
@@ -52,46 +67,182 @@ def is_gibberish(text, threshold=0.3):
     ratio = alnum / max(len(text), 1)
     return ratio < threshold
 
-def ocr_pdf_with_paddleocr(pdf_path, lang='vi'):  # Vietnamese support
-    ocr = PaddleOCR(lang=lang, use_angle_cls=True, show_log=False)
-    doc = fitz.open(pdf_path)
-    all_text = []
-    for page_num in range(len(doc)):
+def ocr_pdf_with_paddleocr(pdf_path, lang='vi', pages=None):  # Vietnamese support
+    """
+    OCR the given 0-based `pages` of a PDF (every page when None).
+
+    Pages are processed in parallel, bounded by the OCR engine pool, and
+    returned as one Document per page carrying `source` and `page`
+    metadata, in page order. Pages without recognisable text are dropped.
+    """
+    if pages is None:
+        with fitz.open(pdf_path) as doc:
+            pages = list(range(len(doc)))
+    if not pages:
+        return []
+
+    # More threads than engines would only queue on the pool
+    workers = min(OCR_PAGE_WORKERS, get_ocr_pool().size, len(pages))
+    if workers <= 1:
+        results = [_ocr_pdf_page(pdf_path, page_num, lang) for page_num in pages]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(lambda n: _ocr_pdf_page(pdf_path, n, lang), pages))
+    return [doc for doc in results if doc is not None]
+
+
+def _ocr_pdf_page(pdf_path, page_num, lang='vi'):
+    import numpy as np
+    import cv2
+
+    # Decode the page images first so the engine is only held for inference
+    images = []
+    with fitz.open(pdf_path) as doc:
         page = doc.load_page(page_num)
-        images = page.get_images(full=True)
-        page_text = []
-        for img_index, img in enumerate(images):
-            xref = img[0]
-            base_image = doc.extract_image(xref)
-            image_bytes = base_image["image"]
-            import numpy as np
-            import cv2
-            img_array = np.frombuffer(image_bytes, np.uint8)
+        for img in page.get_images(full=True):
+            base_image = doc.extract_image(img[0])
+            img_array = np.frombuffer(base_image["image"], np.uint8)
             img_cv = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
             if img_cv is not None:
-                result = ocr.ocr(img_cv, cls=True)
-                for line in result:
-                    for box in line:
-                        text = box[1][0]
-                        page_text.append(text)
-        # If no images, try to render the page as an image and OCR it
+                images.append(img_cv)
+        # If no images, render the page as an image and OCR it
         if not images:
             pix = page.get_pixmap()
-            img_cv = np.frombuffer(pix.samples, dtype=np.uint8).reshape((pix.height, pix.width, pix.n))
+            images.append(np.frombuffer(pix.samples, dtype=np.uint8).reshape((pix.height, pix.width, pix.n)))
+
+    page_text = []
+    with get_ocr_pool().acquire(lang) as ocr:
+        for img_cv in images:
             result = ocr.ocr(img_cv, cls=True)
-            for line in result:
-                for box in line:
-                    text = box[1][0]
-                    page_text.append(text)
-        if page_text:
-            all_text.append(f"Page {page_num+1}:\n" + "\n".join(page_text))
-    doc.close()
-    if all_text:
-        return [Document(page_content="\n\n".join(all_text), metadata={"source": pdf_path})]
-    return []
+            for line in result or []:
+                for box in line or []:
+                    page_text.append(box[1][0])
 
+    if not page_text:
+        return None
+    return Document(page_content="\n".join(page_text), metadata={"source": pdf_path, "page": page_num})
 
-def load_text_from_txt_file(filepath):
+
+def _load_pdf(path: str, fn: str, messages: list):
+    """
+    Load a PDF's text layer page by page and pick the pages to OCR: the
+    ones whose text is gibberish, or every page when the text layer
+    cannot be read at all.
+
+    Returns (Documents, 0-based pages to OCR or None). The OCR itself is
+    left to `_apply_ocr` in the parent process, so the OCR engines stay in
+    the one shared pool instead of being loaded in every extraction
+    worker.
+    """
+    try:
+        loaded = PyPDFLoader(path).load()
+    except Exception as e:
+        loaded = []
+
+    if not loaded:
+        messages.append(("warning", f"⚠️ Falling back to PaddleOCR for: {fn}"))
+        try:
+            with fitz.open(path) as doc:
+                return [], list(range(len(doc)))
+        except Exception as e:
+            messages.append(("error", f"❌ Failed to open PDF {fn}: {e}"))
+            return [], None
+
+    scanned = sorted(
+        doc.metadata.get("page", i)
+        for i, doc in enumerate(loaded)
+        if is_gibberish(doc.page_content)
+    )
+    if not scanned:
+        return loaded, None
+
+    messages.append(("warning", f"⚠️ Falling back to PaddleOCR for {len(scanned)}/{len(loaded)} pages of: {fn}"))
+    return loaded, scanned
+
+
+def _apply_ocr(path: str, fn: str, loaded: list, pages: List[int], messages: list):
+    """
+    OCR `pages` of a PDF with the process-wide engine pool and put the
+    results in place of those pages of `loaded` (all of the file when
+    `loaded` is empty). Pages without recognisable text are dropped.
+
+    A failed OCR is reported as an error, which also keeps the partial
+    result out of the extraction cache.
+    """
+    try:
+        ocr_pages = {doc.metadata["page"]: doc for doc in ocr_pdf_with_paddleocr(path, lang='vi', pages=pages)}
+    except Exception as ocr_e:
+        messages.append(("error", f"❌ OCR failed for {len(pages)} pages of {fn}, they were left out: {ocr_e}"))
+        ocr_pages = {}
+    if not loaded:
+        return [ocr_pages[n] for n in sorted(ocr_pages)]
+
+    scanned = set(pages)
+    docs = []
+    for i, doc in enumerate(loaded):
+        page_num = doc.metadata.get("page", i)
+        if page_num not in scanned:
+            docs.append(doc)
+        elif page_num in ocr_pages:
+            docs.append(Document(page_content=ocr_pages[page_num].page_content, metadata=dict(doc.metadata)))
+    return docs
+
+
+def _docx_blocks(document):
+    """Yield (style name, text) for each paragraph and table row of the body, in order."""
+    from docx.table import Table
+    from docx.text.paragraph import Paragraph
+
+    for child in document.element.body.iterchildren():
+        tag = child.tag.rsplit("}", 1)[-1]
+        if tag == "p":
+            para = Paragraph(child, document)
+            yield (para.style.name if para.style is not None else ""), para.text
+        elif tag == "tbl":
+            for row in Table(child, document).rows:
+                cells = []
+                for cell in row.cells:
+                    text = cell.text.strip()
+                    # Merged cells repeat once per grid column they span
+                    if text and (not cells or cells[-1] != text):
+                        cells.append(text)
+                yield "", " | ".join(cells)
+
+
+def _load_docx(path: str):
+    """
+    Load a .docx as one Document per heading section (metadata `section`),
+    falling back to Docx2txtLoader when python-docx is unavailable or the
+    document has no headings. Table rows are kept, in place, as
+    "cell | cell" lines of the section they appear in.
+    """
+    try:
+        import docx
+        blocks = list(_docx_blocks(docx.Document(path)))
+    except Exception:
+        return Docx2txtLoader(path).load()
+
+    sections = []
+    title, lines = "", []
+    for style, text in blocks:
+        if style.startswith("Heading") or style == "Title":
+            if lines:
+                sections.append((title, lines))
+            title, lines = text.strip(), [text]
+        elif text.strip():
+            lines.append(text)
+    if lines:
+        sections.append((title, lines))
+
+    if len(sections) <= 1:
+        return Docx2txtLoader(path).load()
+    return [
+        Document(page_content="\n\n".join(lines), metadata={"source": path, "section": title})
+        for title, lines in sections
+    ]
+
+
+def _read_text_file(filepath):
     encodings = ['utf-8', 'utf-16', 'cp1252', 'iso-8859-1', 'gbk']
     for encoding in encodings:
         try:
@@ -100,95 +251,466 @@ def load_text_from_txt_file(filepath):
             return [Document(page_content=content, metadata={"source": filepath})]
         except (UnicodeDecodeError, LookupError):
             continue
+    return None
+
+
+def load_text_from_txt_file(filepath):
+    docs = _read_text_file(filepath)
+    if docs is None:
+        st.error(f"Cannot decode text file: {filepath}")
+        return []
+    return docs
 
-    st.error(f"Cannot decode text file: {filepath}")
-    return []
 
+def st_report(level: str, message: str) -> None:
+    """Forward a (level, message) pair to the matching Streamlit call."""
+    getattr(st, level, st.write)(message)
 
-def extract_text(file_list: List[str], docs_dir: str = DEFAULT_DOCS_DIR):
+
+def _extract_file(path: str, fn: str):
+    """
+    Run the loader matching the extension of one file.
+
+    Executed inside the extraction process pool, so it must not touch
+    Streamlit: user-facing messages are returned as (level, text) pairs
+    and reported by the parent process. Neither does it OCR: PDF pages
+    that need it are returned as the third element, for `_apply_ocr`.
+    """
     docs = []
-    for fn in file_list:
+    messages = []
+    ocr_pages = None
+    try:
+        if fn.lower().endswith(".pdf"):
+            loaded, ocr_pages = _load_pdf(path, fn, messages)
+            docs.extend(loaded)
+        elif fn.lower().endswith(".txt"):
+            loaded = _read_text_file(path)
+            if loaded is None:
+                messages.append(("error", f"Cannot decode text file: {path}"))
+            else:
+                docs.extend(loaded)
+        elif fn.lower().endswith(".docx"):
+            docs.extend(_load_docx(path))
+        elif fn.lower().endswith(".doc"):
+            docs.extend(UnstructuredWordDocumentLoader(path).load())
+        elif fn.lower().endswith(".xls") or fn.lower().endswith(".xlsx"):
+            # Excel support for both .xls and .xlsx, with engine selection
+            try:
+                if fn.lower().endswith(".xls"):
+                    df = pd.read_excel(path, sheet_name=None, engine="xlrd")
+                else:
+                    df = pd.read_excel(path, sheet_name=None, engine="openpyxl")
+            except Exception as e:
+                # Fallback to default engine if specified engine fails
+                try:
+                    df = pd.read_excel(path, sheet_name=None)
+                except Exception as e2:
+                    messages.append(("error", f"❌ Failed to read Excel file {fn}: {e2}"))
+                    return docs, messages, None
+            # One Document per sheet so chunks never straddle two sheets
+            for sheet, data in df.items():
+                text = f"Sheet: {sheet}\n" + data.to_string(index=False)
+                if data.size:
+                    docs.append(Document(page_content=text, metadata={"source": path, "sheet": str(sheet)}))
+        else:
+            messages.append(("warning", f"⚠️ Unsupported file type: {fn}"))
+    except Exception as e:
+        messages.append(("error", f"❌ Failed to process {fn}: {e}"))
+    return docs, messages, ocr_pages
+
+
+# --- Extraction process pool ---
+_extract_pool = None
+_extract_pool_lock = threading.Lock()
+
+
+def _get_extract_pool() -> ProcessPoolExecutor:
+    """Lazily start the process-wide extraction pool."""
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is None:
+            _extract_pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS)
+        return _extract_pool
+
+
+def _reset_extract_pool(broken: ProcessPoolExecutor) -> ProcessPoolExecutor:
+    """
+    Replace a broken pool with a fresh one and return it. Another job may
+    already have replaced it, in which case its new pool is kept.
+    """
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is broken:
+            broken.shutdown(wait=False, cancel_futures=True)
+            _extract_pool = None
+    return _get_extract_pool()
+
+
+def iter_extracted(
+    file_list: List[str],
+    docs_dir: str = DEFAULT_DOCS_DIR,
+    parallel: bool = True,
+    report=st_report,
+    use_cache: bool = True,
+    max_pending: int = None
+):
+    """
+    Yield (filename, Documents, file info) for every file in `file_list`,
+    in order. The file info holds the size, mtime and SHA-256 taken before
+    extraction (None if the file could not be read).
+
+    Each file is hashed first and looked up in the content-addressed
+    extraction cache; only misses run a loader. With `parallel=True` the
+    per-format loaders run in a bounded process pool (EXTRACT_WORKERS
+    processes) and at most `max_pending` files are extracted ahead of the
+    consumer, so a slow consumer holds back extraction instead of letting
+    results pile up in memory. PDF pages that need OCR are OCR'd here, in
+    this process, through the shared engine pool. Errors are reported per
+    file; a file that fails is still yielded, with no Documents.
+
+    A worker that crashes (e.g. a segfault in a native loader) breaks the
+    whole pool and every file in flight with it. The pool is replaced at
+    once, the file at the head is retried alone to tell the file that
+    crashed from its bystanders, and the rest are resubmitted; only a
+    file that crashes its worker on its own is reported as failed.
+    """
+    cache = get_extraction_cache() if use_cache else None
+    pool = _get_extract_pool() if parallel and EXTRACT_WORKERS > 1 and len(file_list) > 1 else None
+    max_pending = max_pending or EXTRACT_WORKERS * 2
+
+    owner = {}   # future -> the pool running it
+
+    def submit(path, fn):
+        nonlocal pool
+        try:
+            future = pool.submit(_extract_file, path, fn)
+        except BrokenProcessPool:
+            pool = _reset_extract_pool(pool)
+            future = pool.submit(_extract_file, path, fn)
+        owner[future] = pool
+        return future
+
+    def start(fn):
         path = os.path.join(docs_dir, fn)
         try:
-            if fn.lower().endswith(".pdf"):
-                loaded = PyPDFLoader(path).load()
-                all_text = " ".join(doc.page_content for doc in loaded)
-                if not loaded or is_gibberish(all_text):
-                    st.warning(f"⚠️ Falling back to PaddleOCR for: {fn}")
-                    try:
-                        ocr_loaded = ocr_pdf_with_paddleocr(path, lang='vi')
-                        docs.extend(ocr_loaded)
-                    except Exception as ocr_e:
-                        continue
+            info = stat_file(path)
+        except OSError:
+            info = None   # the loader reports the missing/unreadable file
+        if cache is not None and info is not None:
+            # Cache hit: one hash plus one read
+            hit = cache.get(info["sha256"], path)
+            if hit is not None:
+                return path, fn, info, hit, None
+        future = submit(path, fn) if pool is not None else None
+        return path, fn, info, None, future
+
+    def recover(path, fn, future):
+        """Replace the broken pool, retry `fn` alone, then resubmit the other files it broke."""
+        nonlocal pool
+        broken = owner.pop(future)
+        victims = [f for *_, f in pending if f is not None and owner.get(f) is broken]
+        # The pool fails all of its futures once it breaks
+        wait(victims)
+        pool = _reset_extract_pool(broken)
+        try:
+            result = pool.submit(_extract_file, path, fn).result()
+        except BrokenProcessPool:
+            pool = _reset_extract_pool(pool)
+            result = None
+        for i, (p, f, info, hit, other) in enumerate(pending):
+            if other in victims and (other.cancelled() or other.exception() is not None):
+                owner.pop(other, None)
+                pending[i] = (p, f, info, hit, submit(p, f))
+        return result
+
+    pending = deque()
+    files = iter(file_list)
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < max_pending:
+                fn = next(files, None)
+                if fn is None:
+                    exhausted = True
                 else:
-                    docs.extend(loaded)
-            elif fn.lower().endswith(".txt"):
-                docs.extend(load_text_from_txt_file(path))
-            elif fn.lower().endswith(".docx"):
-                docs.extend(Docx2txtLoader(path).load())
-            elif fn.lower().endswith(".doc"):
-                docs.extend(UnstructuredWordDocumentLoader(path).load())
-            elif fn.lower().endswith(".xls") or fn.lower().endswith(".xlsx"):
-                # Excel support for both .xls and .xlsx, with engine selection
+                    pending.append(start(fn))
+            if not pending:
+                break
+
+            path, fn, info, hit, future = pending.popleft()
+            if hit is not None:
+                yield fn, hit, info
+                continue
+            if future is not None:
                 try:
-                    if fn.lower().endswith(".xls"):
-                        df = pd.read_excel(path, sheet_name=None, engine="xlrd")
-                    else:
-                        df = pd.read_excel(path, sheet_name=None, engine="openpyxl")
-                except Exception as e:
-                    # Fallback to default engine if specified engine fails
-                    try:
-                        df = pd.read_excel(path, sheet_name=None)
-                    except Exception as e2:
-                        st.error(f"❌ Failed to read Excel file {fn}: {e2}")
+                    loaded, messages, ocr_pages = future.result()
+                    owner.pop(future, None)
+                except BrokenProcessPool as e:
+                    result = recover(path, fn, future)
+                    if result is None:
+                        # Crashed its worker on its own: a file that cannot be loaded
+                        report("error", f"❌ Failed to process {fn}: the loader crashed ({e})")
+                        yield fn, [], info
                         continue
-                text = ""
-                for sheet, data in df.items():
-                    text += f"Sheet: {sheet}\n"
-                    text += data.to_string(index=False)
-                    text += "\n\n"
-                if text.strip():
-                    docs.append(Document(page_content=text, metadata={"source": path}))
+                    loaded, messages, ocr_pages = result
+                except Exception as e:
+                    owner.pop(future, None)
+                    report("error", f"❌ Failed to process {fn}: {e}")
+                    yield fn, [], info
+                    continue
             else:
-                st.warning(f"⚠️ Unsupported file type: {fn}")
-        except Exception as e:
-            st.error(f"❌ Failed to process {fn}: {e}")
+                loaded, messages, ocr_pages = _extract_file(path, fn)
+            if ocr_pages:
+                loaded = _apply_ocr(path, fn, loaded, ocr_pages, messages)
+            for level, message in messages:
+                report(level, message)
+            if loaded and cache is not None and info is not None and not any(level == "error" for level, _ in messages):
+                cache.put(info["sha256"], loaded)
+            yield fn, loaded, info
+    finally:
+        # The consumer may stop early: don't leave work queued in the pool
+        for *_, future in pending:
+            if future is not None:
+                future.cancel()
+
+
+def extract_text(
+    file_list: List[str],
+    docs_dir: str = DEFAULT_DOCS_DIR,
+    parallel: bool = True,
+    report=st_report,
+    use_cache: bool = True
+):
+    """Extract and concatenate the Documents of every file in `file_list`."""
+    docs = []
+    for _, loaded, _ in iter_extracted(file_list, docs_dir, parallel, report, use_cache):
+        docs.extend(loaded)
     return docs
 
-def get_text_chunks(
-    docs,
-    chunk_size: int = CHUNK_SIZE,
-    chunk_overlap: int = CHUNK_OVERLAP
-):
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap,
-        separators=["\n\n", "\n", " ", ""],
-    )
-    return splitter.split_documents(docs)
+def get_text_chunks(docs, profiles: dict = None):
+    """
+    Split Documents into token-budgeted chunks using the profile of each
+    source type (see utils/chunking.py). Pages, sheets and docx sections
+    arrive as separate Documents, so chunks never cross them.
+    """
+    return split_documents(docs, profiles)
 
 def save_text_chunks(
     chunks,
     chunks_dir: str = DEFAULT_CHUNKS_DIR,
     overwrite: bool = True
 ) -> None:
-    if overwrite and os.path.isdir(chunks_dir):
-        shutil.rmtree(chunks_dir)
-    os.makedirs(chunks_dir, exist_ok=True)
+    """
+    Append chunks to the packed archive in `chunks_dir` (see
+    utils/chunk_store.py), keyed by content hash and grouped by the file
+    name of their source.
+    """
+    store = ChunkStore(chunks_dir)
+    if overwrite:
+        store.clear()
 
-    for i, chunk in enumerate(chunks):
+    by_source = {}
+    for chunk in chunks:
         src = chunk.metadata.get("source", "")
-        base = os.path.splitext(os.path.basename(src))[0] if src else "doc"
-        fname = f"{base}_chunk_{i:04d}.txt"
-        path = os.path.join(chunks_dir, fname)
-        with open(path, "w", encoding="utf-8") as f:
-            f.write(chunk.page_content)
+        by_source.setdefault(os.path.basename(src) if src else "doc", []).append(
+            (hash_text(chunk.page_content), chunk)
+        )
+    for source, items in by_source.items():
+        store.append(source, items)
 
-    print(f"✅ Exported {len(chunks)} chunks to '{chunks_dir}/'")
+    print(f"✅ Exported {len(chunks)} chunks to '{store.archive_path}'")
     
 def hash_text(text: str) -> str:
     return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
+def open_store(persist_dir: str) -> Chroma:
+    """
+    Open (or create) a Chroma store with the configured embedding
+    backend. Raises IndexMismatchError if the store was built by a
+    different embedding model.
+    """
+    model_id, embedding = get_embedding_backend()
+    vectordb = Chroma(
+        persist_directory=persist_dir,
+        embedding_function=embedding
+    )
+    has_vectors = bool(vectordb.get(limit=1, include=[]).get("ids"))
+    ensure_embedding_model(persist_dir, model_id, has_vectors)
+    return vectordb
+
+def open_chunk_index(vectordb: Chroma, persist_dir: str) -> ChunkIndex:
+    """Open the store's file -> chunk IDs index, backfilling it for older stores."""
+    index = ChunkIndex(persist_dir)
+    if index.is_empty() and vectordb.get(limit=1, include=[]).get("ids"):
+        index.backfill(vectordb)
+    return index
+
+def remove_source(
+    vectordb: Chroma,
+    index: ChunkIndex,
+    lexical: BM25Index,
+    archive: ChunkStore,
+    fname: str
+) -> List[str]:
+    """
+    Drop one file from a store and its indexes. Vectors no other file
+    references are deleted; a vector shared with another file is kept and,
+    if its metadata named `fname`, re-pointed at a file that still uses
+    it, so retrieval never cites a deleted document. Returns the IDs of
+    the deleted vectors.
+    """
+    chunk_ids = index.chunk_ids(fname)
+    orphans = index.remove_source(fname)
+    if orphans:
+        vectordb.delete(ids=orphans)
+        lexical.remove(orphans)
+    archive.remove_source(fname)
+
+    shared = list(set(chunk_ids) - set(orphans))
+    if not shared:
+        return orphans
+    page = vectordb.get(ids=shared, include=["metadatas"])
+    stale = {
+        cid: meta or {}
+        for cid, meta in zip(page.get("ids") or [], page.get("metadatas") or [])
+        if os.path.basename((meta or {}).get("source", "")) == fname
+    }
+    by_owner = {}
+    for cid, owner in index.owners(stale).items():
+        by_owner.setdefault(owner, []).append(cid)
+    ids, metadatas = [], []
+    for owner, cids in by_owner.items():
+        adopted = archive.adopt(owner, cids)
+        for cid in cids:
+            ids.append(cid)
+            # Files indexed before the archive existed have no record to adopt
+            metadatas.append(adopted[cid].metadata if cid in adopted else repoint_metadata(stale[cid], owner))
+    if ids:
+        # Metadata only: the text, hence the embedding, is unchanged
+        vectordb._collection.update(ids=ids, metadatas=metadatas)
+    return orphans
+
+def reset_if_chunking_changed(
+    vectordb: Chroma,
+    persist_dir: str,
+    manifest: Manifest,
+    chunks_dir: str = None
+) -> bool:
+    """
+    Empty the store when it was built with other chunking settings (chunk
+    size, overlap, separators or tokenizer), so every document is chunked
+    and embedded again. The chunk archive in `chunks_dir` is cleared too.
+    Records the current settings in the index metadata. Returns True if
+    the store was reset.
+    """
+    signature = chunking_signature()
+    meta = read_index_meta(persist_dir)
+    if meta.get("chunking") == signature:
+        return False
+
+    ids = vectordb.get(include=[]).get("ids") or []
+    for start in range(0, len(ids), 5000):
+        vectordb.delete(ids=ids[start:start + 5000])
+    ChunkIndex(persist_dir).clear()
+    BM25Index(persist_dir).clear()
+    if chunks_dir:
+        ChunkStore(chunks_dir).clear()
+    manifest.forget(list(manifest.entries))
+
+    meta["chunking"] = signature
+    write_index_meta(persist_dir, meta)
+    bump_index_version(persist_dir)
+    return bool(ids)
+
+def ingest_files(
+    vectordb: Chroma,
+    new_files: List[str],
+    docs_dir: str,
+    manifest: Manifest,
+    chunks_dir: str,
+    report=st_report,
+    batch_size: int = INGEST_BATCH_SIZE,
+    max_pending: int = None,
+    progress=None
+) -> int:
+    """
+    Stream files through extraction, splitting, dedup, embedding and
+    Chroma insertion, one file at a time and `batch_size` chunks per
+    add_documents call.
+
+    A file is committed to the store's manifest only after all of its
+    vectors have landed, so an interrupted ingestion resumes with the first
+    uncommitted file. Chunk IDs are content hashes: re-adding a partially
+    ingested file overwrites its vectors instead of duplicating them.
+
+    `progress(filename, stage)` is called as each file moves through the
+    "chunking", "embedding" and "done" stages.
+
+    The chunk IDs of each file are recorded in the store's ChunkIndex so
+    the file can later be removed or replaced with targeted deletes, and
+    chunks whose content hash is already in the index are not embedded
+    again. Every chunk of the file is appended to the ChunkStore archive
+    in `chunks_dir`, which rebuild_user_vectorstore re-embeds from, and
+    new chunks are added to the store's BM25 index for hybrid retrieval.
+
+    Returns the number of unique chunks added.
+    """
+    progress = progress or (lambda fname, stage: None)
+    persist_dir = os.path.dirname(manifest.path)
+    index = open_chunk_index(vectordb, persist_dir)
+    lexical = open_lexical_index(vectordb, persist_dir)
+    archive = ChunkStore(chunks_dir)
+    seen_hashes = set()
+    added = 0
+    for fname, docs, info in iter_extracted(new_files, docs_dir, report=report, max_pending=max_pending):
+        progress(fname, "chunking")
+        chunks = get_text_chunks(docs)
+        del docs
+        hashes = [hash_text(chunk.page_content) for chunk in chunks]
+
+        # Deduplicate by chunk content hash, within this run and against
+        # every chunk already stored
+        known = index.lookup(hashes)
+        unique_chunks = []
+        chunk_ids = []
+        file_chunks = []
+        for chunk, content_hash in zip(chunks, hashes):
+            if content_hash in known:
+                file_chunks.append((known[content_hash], chunk))
+                continue
+            file_chunks.append((content_hash, chunk))
+            if content_hash not in seen_hashes:
+                seen_hashes.add(content_hash)
+                unique_chunks.append(chunk)
+                chunk_ids.append(content_hash)
+        del chunks
+
+        progress(fname, "embedding")
+        for start in range(0, len(unique_chunks), batch_size):
+            vectordb.add_documents(
+                unique_chunks[start:start + batch_size],
+                ids=chunk_ids[start:start + batch_size]
+            )
+        if unique_chunks:
+            vectordb.persist()
+            lexical.add(zip(chunk_ids, (chunk.page_content for chunk in unique_chunks)))
+
+        # Record every chunk of the file, including ones embedded for an
+        # earlier file, so deleting either keeps the other.
+        index.add_hashes({cid: cid for cid in chunk_ids})
+        index.add(fname, {cid for cid, _ in file_chunks})
+        archive.append(fname, file_chunks)
+        del file_chunks
+
+        bump_index_version(persist_dir)
+
+        # Commit the file only once its vectors are stored
+        if info is not None:
+            manifest.commit(fname, info)
+        added += len(unique_chunks)
+        progress(fname, "done")
+    return added
+
 def get_vectorstore(
     file_list: List[str],
     docs_dir: str = DEFAULT_DOCS_DIR,
@@ -202,59 +724,35 @@ def get_vectorstore(
     #     model="text-embedding-3-large",
     #     openai_api_key=st.secrets["OPENAI_API_KEY"]
     # )
-    embedding = GoogleGenerativeAIEmbeddings(
-        model="models/embedding-001",
-        google_api_key=os.getenv('GEMINI_API_KEY')
-    )
 
     # Load or create vectorstore
-    vectordb = Chroma(
-        persist_directory=persist_dir,
-        embedding_function=embedding
-    )
-
-    # Load previously embedded file list
-    cache_path = os.path.join(persist_dir, "files.txt")
-    prev_files = set()
-    if os.path.exists(cache_path):
-        with open(cache_path, "r", encoding="utf-8") as f:
-            prev_files = set(line.strip() for line in f)
-
-    # Filter new files
-    new_files = [f for f in file_list if f not in prev_files]
+    vectordb = open_store(persist_dir)
+
+    # Compare against what the store was built from
+    manifest = get_manifest(persist_dir, docs_dir)
+    if reset_if_chunking_changed(vectordb, persist_dir, manifest, chunks_dir):
+        print("♻️ Chunking settings changed — rebuilding the store.")
+    new, modified, removed = manifest.diff(docs_dir)
+    new_files = [f for f in file_list if f in new or f in modified]
+    if removed or modified:
+        index = open_chunk_index(vectordb, persist_dir)
+        lexical = open_lexical_index(vectordb, persist_dir)
+        archive = ChunkStore(chunks_dir)
+        for fname in removed + modified:
+            remove_source(vectordb, index, lexical, archive, fname)
+        manifest.forget(removed + modified)
+        bump_index_version(persist_dir)
     if not new_files:
         print("✅ No new files to add.")
         return vectordb
 
     print(f"🆕 New files to process: {new_files}")
-    docs = extract_text(new_files, docs_dir)
-    chunks = get_text_chunks(docs)
-
-    # Deduplicate by chunk content hash
-    seen_hashes = set()
-    unique_chunks: List[Document] = []
-    for chunk in chunks:
-        content_hash = hash_text(chunk.page_content)
-        if content_hash not in seen_hashes:
-            seen_hashes.add(content_hash)
-            unique_chunks.append(chunk)
-
-    # Add only unique chunks
-    if unique_chunks:
-        vectordb.add_documents(unique_chunks)
-        vectordb.persist()
-        print(f"✅ Added {len(unique_chunks)} unique chunks.")
+    added = ingest_files(vectordb, new_files, docs_dir, manifest, chunks_dir)
+    if added:
+        print(f"✅ Added {added} unique chunks.")
     else:
         print("⚠️ No unique chunks to embed — skipping update.")
 
-    # Append new files to file cache
-    with open(cache_path, "a", encoding="utf-8") as f:
-        for fname in new_files:
-            f.write(fname + "\n")
-
-    # Save new chunks for inspection
-    save_text_chunks(unique_chunks, chunks_dir=chunks_dir, overwrite=False)
-
     return vectordb
 
 
@@ -275,111 +773,215 @@ def ensure_user_dirs(username: str):
         os.makedirs(dir_path, exist_ok=True)
     return dirs
 
-def has_new_files_user(username: str, current_files: List[str]) -> bool:
-    """Check for new files in user's directory"""
-    dirs = get_user_dirs(username)
-    cache_path = os.path.join(dirs['vectordb'], "files.txt")
-
-    if not os.path.exists(cache_path):
-        return True
+# username -> (docs dir mtime, manifest version, result, checked at)
+_change_cache = {}
+_change_cache_lock = threading.Lock()
 
-    with open(cache_path, "r", encoding="utf-8") as f:
-        cached_files = set(line.strip() for line in f.readlines())
-    return set(current_files) != cached_files
+def get_user_manifest(username: str) -> Manifest:
+    """The manifest of the user's vector store."""
+    dirs = get_user_dirs(username)
+    return get_manifest(dirs['vectordb'], dirs['docs'])
 
-def get_vectorstore_user(
-        username: str,
-        file_list: List[str]
-) -> 'Chroma':
+def has_new_files_user(username: str, current_files: List[str] = None) -> bool:
     """
-    Get user-specific vectorstore
+    Check for new, modified or removed files in user's directory.
+
+    Cached against the docs directory mtime and the manifest version, so
+    a rerun where nothing changed costs a single stat. Files written
+    through atomic_write (temp file + rename) update the directory mtime;
+    a file overwritten in place by anything else does not, so the cached
+    result is also re-checked against per-file stats once it is older
+    than CHANGE_CHECK_TTL seconds.
     """
-    from langchain_google_genai import GoogleGenerativeAIEmbeddings
-    from langchain_community.vectorstores import Chroma
-
-    # Ensure user directories exist
+    dirs = get_user_dirs(username)
+    try:
+        dir_mtime = os.stat(dirs['docs']).st_mtime_ns
+    except OSError:
+        return False
+    manifest = get_user_manifest(username)
+    stamp = (dir_mtime, manifest.version)
+
+    with _change_cache_lock:
+        cached = _change_cache.get(username)
+    if (cached is not None and cached[:2] == stamp
+            and time.monotonic() - cached[3] < CHANGE_CHECK_TTL):
+        return cached[2]
+
+    new, modified, removed = manifest.diff(dirs['docs'])
+    result = bool(new or modified or removed)
+    # Chunking settings only change with a restart, so checking them on a
+    # cache miss (always the first call in a process) is enough
+    if read_index_meta(dirs['vectordb']).get("chunking") != chunking_signature() and manifest.entries:
+        result = True
+    with _change_cache_lock:
+        _change_cache[username] = (dir_mtime, manifest.version, result, time.monotonic())
+    return result
+
+def open_vectorstore_user(username: str) -> Chroma:
+    """Open (or create) the user's vectorstore without ingesting anything."""
     dirs = ensure_user_dirs(username)
+    return open_store(dirs['vectordb'])
 
-    embedding = GoogleGenerativeAIEmbeddings(
-        model="models/embedding-001",
-        google_api_key=os.getenv('GEMINI_API_KEY')
-    )
-
-    # Load or create user-specific vectorstore
-    vectordb = Chroma(
-        persist_directory=dirs['vectordb'],
-        embedding_function=embedding
-    )
-
-    # Load previously embedded file list
-    cache_path = os.path.join(dirs['vectordb'], "files.txt")
-    prev_files = set()
-    if os.path.exists(cache_path):
-        with open(cache_path, "r", encoding="utf-8") as f:
-            prev_files = set(line.strip() for line in f)
-
-    # Filter new files
-    new_files = [f for f in file_list if f not in prev_files]
-    if not new_files:
-        return vectordb
-
-    st.info(f"🆕 Processing {len(new_files)} new files for user: {username}")
-
-    # Extract text from new files
-    docs = extract_text(new_files, dirs['docs'])
-    chunks = get_text_chunks(docs)
-
-    # Deduplicate by chunk content hash
-    seen_hashes = set()
-    unique_chunks = []
-    for chunk in chunks:
-        content_hash = hash_text(chunk.page_content)
-        if content_hash not in seen_hashes:
-            seen_hashes.add(content_hash)
-            unique_chunks.append(chunk)
-
-    # Add only unique chunks
-    if unique_chunks:
-        vectordb.add_documents(unique_chunks)
-        vectordb.persist()
-
-        # st.success(f"✅ Added {len(unique_chunks)} unique chunks for {username}")
+def get_pending_files_user(username: str, file_list: List[str] = None) -> List[str]:
+    """New or modified files (restricted to `file_list` if given) not yet indexed as they are on disk"""
+    dirs = get_user_dirs(username)
+    new, modified, _ = get_user_manifest(username).diff(dirs['docs'])
+    pending = new + modified
+    if file_list is not None:
+        wanted = set(file_list)
+        pending = [f for f in pending if f in wanted]
+    return pending
+
+def ingest_user_files(
+        username: str,
+        file_list: List[str] = None,
+        report=st_report,
+        progress=None,
+        max_files: int = None
+) -> Tuple[int, int]:
+    """
+    Bring the user's store in line with their docs directory.
 
-        # Lưu thông báo vào session state thay vì st.success
-        st.session_state[f'vectorstore_success_{username}'] = f"✅ Added {len(unique_chunks)} unique chunks for {username}"
+    Vectors of removed files are deleted, modified files are re-indexed
+    in place and new files are embedded. At most `max_files` files are
+    embedded per call so a background worker can interleave large uploads
+    from different users.
 
-    # Update file cache
-    with open(cache_path, "a", encoding="utf-8") as f:
-        for fname in new_files:
-            f.write(fname + "\n")
+    Returns (chunks added, files still pending).
+    """
+    dirs = ensure_user_dirs(username)
+    manifest = get_user_manifest(username)
+    if reset_if_chunking_changed(open_vectorstore_user(username), dirs['vectordb'], manifest, dirs['chunks']):
+        report("info", f"♻️ Chunking settings changed — rebuilding the knowledge base of {username}")
+    new, modified, removed = manifest.diff(dirs['docs'])
+    if file_list is not None:
+        wanted = set(file_list)
+        new = [f for f in new if f in wanted]
+        modified = [f for f in modified if f in wanted]
+
+    for fname in removed:
+        remove_document_vectors(username, fname)
+    manifest.forget(removed)
+
+    pending = modified + new
+    if not pending:
+        return 0, 0
+
+    batch = pending[:max_files] if max_files else pending
+    for fname in batch:
+        if fname in manifest:
+            # Changed on disk: drop the old vectors before re-embedding
+            remove_document_vectors(username, fname)
+            manifest.forget([fname])
+
+    vectordb = open_vectorstore_user(username)
+    added = ingest_files(
+        vectordb, batch, dirs['docs'], manifest, dirs['chunks'],
+        report=report, progress=progress
+    )
+    return added, len(pending) - len(batch)
 
-    # Save chunks for inspection
-    save_text_chunks(unique_chunks, chunks_dir=dirs['chunks'], overwrite=False)
+def remove_document_vectors(username: str, filename: str) -> int:
+    """
+    Delete the vectors of one document from the user's store and drop it
+    from the BM25 index and the chunk archive.
 
-    return vectordb
+    Chunks that another document still references are kept. Returns the
+    number of vectors deleted.
+    """
+    dirs = ensure_user_dirs(username)
+    vectordb = open_vectorstore_user(username)
+    orphans = remove_source(
+        vectordb,
+        open_chunk_index(vectordb, dirs['vectordb']),
+        open_lexical_index(vectordb, dirs['vectordb']),
+        ChunkStore(dirs['chunks']),
+        filename
+    )
+    bump_index_version(dirs['vectordb'])
+    return len(orphans)
 
 def cleanup_user_data(username: str):
     """Clean up all user data"""
     user_base = f"users/{username}"
     if os.path.exists(user_base):
         shutil.rmtree(user_base)
+        drop_manifest(get_user_dirs(username)['vectordb'])
+        get_answer_cache().clear(get_user_dirs(username)['vectordb'])
         st.success(f"🗑️ Cleaned up all data for user: {username}")
 
-# def rebuild_user_vectorstore(username: str):
-#     """Rebuild vectorstore from scratch for user"""
-#     dirs = get_user_dirs(username)
-#
-#     # Xóa toàn bộ vectorstore cũ
-#     if os.path.exists(dirs['vectordb']):
-#         shutil.rmtree(dirs['vectordb'])
-#
-#     # Tạo lại thư mục
-#     os.makedirs(dirs['vectordb'], exist_ok=True)
-#
-#     # Lấy danh sách file hiện tại và rebuild
-#     current_files = get_user_documents(username)
-#     if current_files:
-#         return get_vectorstore_user(username, current_files)
-#
-#     return None
-
+def rebuild_user_vectorstore(
+        username: str,
+        report=st_report,
+        progress=None,
+        batch_size: int = INGEST_BATCH_SIZE
+) -> int:
+    """
+    Rebuild the user's vector store from the chunk archive with the
+    configured embedding backend, e.g. after switching EMBEDDING_BACKEND.
+
+    Chunks are re-embedded as archived, without extracting or splitting
+    the documents again. Files indexed before the archive existed have no
+    archived chunks and are re-ingested from the docs directory instead.
+    The new model is recorded in the index metadata only once every chunk
+    is embedded. Returns the number of chunks embedded.
+    """
+    dirs = ensure_user_dirs(username)
+    progress = progress or (lambda fname, stage: None)
+    model_id, embedding = get_embedding_backend()
+
+    # Open without the model check: the old vectors are about to go
+    vectordb = Chroma(persist_directory=dirs['vectordb'], embedding_function=embedding)
+    ids = vectordb.get(include=[]).get("ids") or []
+    for start in range(0, len(ids), 5000):
+        vectordb.delete(ids=ids[start:start + 5000])
+    index = ChunkIndex(dirs['vectordb'])
+    index.clear()
+    lexical = BM25Index(dirs['vectordb'])
+    lexical.clear()
+    bump_index_version(dirs['vectordb'])
+
+    archive = ChunkStore(dirs['chunks'])
+    archived = set(archive.sources())
+    manifest = get_user_manifest(username)
+    missing = [f for f in manifest.entries if f not in archived]
+    if missing:
+        manifest.forget(missing)
+
+    embedded = set()
+    for fname in sorted(archived):
+        progress(fname, "embedding")
+        file_hashes = {}
+        batch_docs, batch_ids = [], []
+        for chunk_id, doc in archive.iter_source(fname):
+            file_hashes[hash_text(doc.page_content)] = chunk_id
+            if chunk_id in embedded:
+                continue
+            embedded.add(chunk_id)
+            batch_docs.append(doc)
+            batch_ids.append(chunk_id)
+            if len(batch_docs) >= batch_size:
+                vectordb.add_documents(batch_docs, ids=batch_ids)
+                lexical.add(zip(batch_ids, (doc.page_content for doc in batch_docs)))
+                batch_docs, batch_ids = [], []
+        if batch_docs:
+            vectordb.add_documents(batch_docs, ids=batch_ids)
+            lexical.add(zip(batch_ids, (doc.page_content for doc in batch_docs)))
+        index.add_hashes(file_hashes)
+        index.add(fname, set(file_hashes.values()))
+        progress(fname, "done")
+    added = len(embedded)
+    if added:
+        vectordb.persist()
+    # Only now does the store belong to the new model: if embedding failed
+    # part-way, opening it still raises IndexMismatchError and the rebuild
+    # is offered again
+    meta = read_index_meta(dirs['vectordb'])
+    meta["embedding_model"] = model_id
+    write_index_meta(dirs['vectordb'], meta)
+    bump_index_version(dirs['vectordb'])
+
+    report("success", f"♻️ Rebuilt the knowledge base of {username} from {added} archived chunks")
+    if missing:
+        report("info", f"🆕 Re-ingesting {len(missing)} files without archived chunks")
+    return added
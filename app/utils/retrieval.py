@@ -0,0 +1,108 @@
+# utils/retrieval.py
+
+import os
+import hashlib
+from collections import defaultdict
+from typing import Any, Dict, List, Sequence, Tuple
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from .lexical_index import open_lexical_index
+from .index_meta import index_version
+from .retrieval_cache import embed_query_cached, vector_digest, get_retrieval_cache
+
+# --- Constants ---
+RETRIEVAL_K    = int(os.getenv("RETRIEVAL_K", "4"))        # chunks handed to the LLM
+HYBRID_FETCH_K = int(os.getenv("HYBRID_FETCH_K", "20"))    # candidates per ranker before fusion
+RRF_K          = 60                                        # standard reciprocal rank fusion constant
+
+
+def _content_key(text: str) -> str:
+    # Chunks are deduplicated by content, so the text identifies the vector
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = RRF_K) -> List[Tuple[str, float]]:
+    """Merge ranked key lists: score(d) = sum over lists of 1 / (k + rank of d)."""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] += 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Dense similarity search from Chroma fused with BM25 from the store's
+    lexical index (see utils/lexical_index.py) by reciprocal rank fusion.
+
+    Dense search finds paraphrases; BM25 finds the exact article numbers,
+    codes and names dense search misses. Fusing ranks rather than scores
+    needs no calibration between the two, and only the top `k` fused
+    chunks are returned so the prompt does not grow.
+
+    The query embedding is memoised, and results are cached under
+    (store, index version, query vector, k): a retriever is built for
+    one index version, so any change to the store starts a fresh key.
+    """
+
+    vectorstore: Any
+    lexical: Any
+    store_key: str = ""
+    version: int = 0
+    k: int = RETRIEVAL_K
+    fetch_k: int = HYBRID_FETCH_K
+    rrf_k: int = RRF_K
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        vector = embed_query_cached(self.vectorstore.embeddings, query)
+        cache_key = (self.store_key, self.version, vector_digest(vector), self.k, self.fetch_k, self.rrf_k)
+        cached = get_retrieval_cache().get(cache_key)
+        if cached is not None:
+            return list(cached)
+
+        docs: Dict[str, Document] = {}
+        dense = []
+        for doc in self.vectorstore.similarity_search_by_vector(vector, k=self.fetch_k):
+            key = _content_key(doc.page_content)
+            docs.setdefault(key, doc)
+            dense.append(key)
+
+        # BM25 hits are chunk IDs; only fetch the texts we may return
+        hits = self.lexical.search(query, k=self.fetch_k)
+        lexical = []
+        by_id = {}
+        if hits:
+            page = self.vectorstore.get(ids=[cid for cid, _ in hits], include=["documents", "metadatas"])
+            metadatas = page.get("metadatas") or [{}] * len(page.get("ids") or [])
+            for cid, text, meta in zip(page.get("ids") or [], page.get("documents") or [], metadatas):
+                by_id[cid] = Document(page_content=text or "", metadata=meta or {})
+            for cid, _ in hits:
+                if cid in by_id:
+                    key = _content_key(by_id[cid].page_content)
+                    docs.setdefault(key, by_id[cid])
+                    lexical.append(key)
+
+        fused = reciprocal_rank_fusion([dense, lexical], k=self.rrf_k)
+        result = [docs[key] for key, _ in fused[:self.k]]
+        get_retrieval_cache().put(cache_key, tuple(result))
+        return result
+
+
+def get_retriever(vectordb, persist_dir: str = None) -> BaseRetriever:
+    """
+    Hybrid dense + BM25 retriever over the store in `persist_dir`, or
+    plain dense retrieval when the store's directory is not known.
+    """
+    if persist_dir is None:
+        return vectordb.as_retriever(search_kwargs={"k": RETRIEVAL_K})
+    return HybridRetriever(
+        vectorstore=vectordb,
+        lexical=open_lexical_index(vectordb, persist_dir),
+        store_key=persist_dir,
+        version=index_version(persist_dir)
+    )
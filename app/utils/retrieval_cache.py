@@ -0,0 +1,97 @@
+# utils/retrieval_cache.py
+
+import os
+import re
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Hashable, List
+
+import numpy as np
+
+# --- Constants ---
+QUERY_EMBED_CACHE_SIZE = int(os.getenv("QUERY_EMBED_CACHE_SIZE", "2048"))
+RETRIEVAL_CACHE_SIZE   = int(os.getenv("RETRIEVAL_CACHE_SIZE", "1024"))
+
+
+class LRUCache:
+    """Small thread-safe LRU map with hit/miss counters."""
+
+    _MISSING = object()
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            value = self._data.get(key, self._MISSING)
+            if value is self._MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._data),
+            }
+
+
+# Level 1: normalised query text -> embedding
+_query_embeddings = LRUCache(QUERY_EMBED_CACHE_SIZE)
+# Level 2: (store, index version, query vector digest, k, fetch_k) -> retrieved Documents
+_retrievals = LRUCache(RETRIEVAL_CACHE_SIZE)
+
+
+def normalise_query(text: str) -> str:
+    """Fold case, Unicode form and whitespace so trivially different queries share entries."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip().lower()
+
+
+def embed_query_cached(embeddings, text: str) -> List[float]:
+    """
+    Memoised `embeddings.embed_query`. Keyed by the embedding object, which
+    is a process-wide singleton per backend (see get_embedding_backend).
+    """
+    key = (id(embeddings), normalise_query(text))
+    vector = _query_embeddings.get(key)
+    if vector is None:
+        vector = embeddings.embed_query(text)
+        _query_embeddings.put(key, vector)
+    return vector
+
+
+def vector_digest(vector) -> str:
+    """Stable key for a query vector, rounded so float noise does not split entries."""
+    rounded = np.round(np.asarray(vector, dtype=np.float32), 5)
+    return hashlib.blake2b(rounded.tobytes(), digest_size=16).hexdigest()
+
+
+def get_retrieval_cache() -> LRUCache:
+    return _retrievals
+
+
+def retrieval_cache_stats() -> dict:
+    return {"query_embeddings": _query_embeddings.stats(), "retrievals": _retrievals.stats()}
@@ -1,6 +1,7 @@
 import streamlit as st
 import os
-from .prepare_vectordb import get_user_dirs, ensure_user_dirs
+from .prepare_vectordb import get_user_dirs, ensure_user_dirs, st_report
+from .manifest import atomic_write, list_docs
 
 
 def save_docs_to_vectordb_user(username: str, uploaded_docs, existing_docs):
@@ -28,8 +29,7 @@ def save_docs_to_vectordb_user(username: str, uploaded_docs, existing_docs):
         for doc in new_files:
             file_path = os.path.join(docs_dir, doc.name)
             try:
-                with open(file_path, "wb") as f:
-                    f.write(doc.getvalue())
+                atomic_write(file_path, doc.getvalue())
                 st.success(f"✅ Saved for {username}: {doc.name}")
             except Exception as e:
                 st.error(f"❌ Failed to save {doc.name}: {e}")
@@ -45,36 +45,27 @@ def get_user_documents(username: str):
     dirs = get_user_dirs(username)
     docs_dir = dirs['docs']
 
-    if os.path.exists(docs_dir):
-        return os.listdir(docs_dir)
-    return []
+    return list_docs(docs_dir)
 
 
-def delete_user_document(username: str, filename: str):
-    """Delete specific document for user and update cache"""
-    from .prepare_vectordb import get_user_dirs
+def delete_user_document(username: str, filename: str, report=st_report):
+    """Delete specific document for user, its vectors, and update cache"""
+    from .prepare_vectordb import get_user_dirs, get_user_manifest, remove_document_vectors
 
     dirs = get_user_dirs(username)
     file_path = os.path.join(dirs['docs'], filename)
-    cache_path = os.path.join(dirs['vectordb'], "files.txt")
 
     if os.path.exists(file_path):
         # 1. Xóa file vật lý
         os.remove(file_path)
 
-        # 2. Cập nhật file cache (loại bỏ filename khỏi danh sách)
-        if os.path.exists(cache_path):
-            with open(cache_path, "r", encoding="utf-8") as f:
-                cached_files = [line.strip() for line in f.readlines()]
-
-            # Loại bỏ filename khỏi cache
-            updated_files = [f for f in cached_files if f != filename]
+        # 2. Xóa các vector của tài liệu khỏi Chroma
+        removed = remove_document_vectors(username, filename)
 
-            with open(cache_path, "w", encoding="utf-8") as f:
-                for file in updated_files:
-                    f.write(file + "\n")
+        # 3. Cập nhật manifest (loại bỏ filename khỏi danh sách)
+        get_user_manifest(username).forget([filename])
 
-        st.success(f"🗑️ Deleted {filename} for user {username}")
+        report("success", f"🗑️ Deleted {filename} ({removed} chunks) for user {username}")
         return True
     return False
 
@@ -101,8 +92,7 @@ def save_docs_to_vectordb(uploaded_docs, existing_docs):
         for doc in new_files:
             file_path = os.path.join("docs", doc.name)
             try:
-                with open(file_path, "wb") as f:
-                    f.write(doc.getvalue())
+                atomic_write(file_path, doc.getvalue())
                 # st.success(f"✅ Saved: {doc.name}")  # Removed to avoid duplicate messages
             except Exception as e:
                 continue
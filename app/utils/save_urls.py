@@ -2,16 +2,32 @@
 
 import os
 import re
-import requests
+import hashlib
+from collections import Counter
 import streamlit as st
 from urllib.parse import urlparse, urljoin
 from bs4 import BeautifulSoup
 from bs4.element import Tag
-from typing import List, Tuple, Optional, Set
-from .prepare_vectordb import get_user_dirs, ensure_user_dirs
+from typing import List, Tuple
+from .prepare_vectordb import get_user_dirs, ensure_user_dirs, st_report
+from .manifest import atomic_write
+from .crawler import Download, DownloadRejected, crawl, download
+from .crawl_state import CrawlState
+from .url_dedup import NearDuplicateIndex, canonicalize_url
+from .extraction_cache import file_sha256
+
+try:
+    import lxml  # noqa: F401  (much faster tree builder for BeautifulSoup)
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+# --- Constants ---
+BOILERPLATE_MIN_PAGES = int(os.getenv("BOILERPLATE_MIN_PAGES", "2"))   # earlier pages a block must repeat on
+BLOCK_TAGS            = ["nav", "header", "footer", "aside", "section", "div", "ul", "ol", "table", "form"]
+BLOCK_MIN_CHARS       = 20
+BLOCK_MAX_CHARS       = 3000   # larger blocks are page content, not chrome
 
-# Add a global variable to track first scan
-first_scan_done = False
 
 def save_url_to_vectordb_user(
         username: str,
@@ -19,93 +35,235 @@ def save_url_to_vectordb_user(
         existing_docs: List[str],
         crawl_links: bool = False,
         page_limit: int = 50,
-        _visited: Optional[Set[str]] = None,
-        _crawl_count: Optional[list] = None
+        report=st_report
 ) -> Tuple[str, str]:
     """
-    Fetch a URL and save it to user-specific docs folder
+    Fetch a URL and save it to user-specific docs folder. With
+    `crawl_links`, same-domain links are crawled breadth-first by the
+    concurrent crawler (utils/crawler.py), up to `page_limit` pages.
+
+    Fetches are conditional on what the user's CrawlState recorded, so
+    processing a site again only rewrites the pages that changed; the
+    manifest then picks them up as modified and re-embeds just those.
+
+    URL variants of an already visited page are not fetched again and
+    pages whose text repeats an earlier page of the crawl are not saved;
+    both kinds of skip are logged to the CrawlState with the reason.
+    Pages are keyed by their canonical URL but fetched, and their links
+    resolved, as linked.
+
+    Bodies stream to a temp file in the docs folder (utils/crawler.py
+    `download`), so memory stays flat however large the documents;
+    responses of the wrong type or over the size limits are abandoned
+    and logged as skips too.
     """
     # Get user-specific docs directory
     dirs = ensure_user_dirs(username)
     docs_dir = dirs['docs']
+    state = CrawlState(os.path.dirname(docs_dir))
+    # Learned from this crawl's pages only
+    boilerplate = BoilerplateFilter()
+    dedup = NearDuplicateIndex()
+    start_url = canonicalize_url(url)
+    result = ["", ""]
+    counts = {"new": 0, "updated": 0, "unchanged": 0, "duplicate": 0}
+
+    def fetch_page(page_url):
+        key = canonicalize_url(page_url)
+        page = state.get(key)
+        headers = {}
+        # Only trust a 304 while the saved copy still exists
+        if page and page["fname"] and os.path.exists(os.path.join(docs_dir, page["fname"])):
+            headers = state.conditional_headers(key)
+        return download(page_url, docs_dir, headers=headers)
+
+    def on_error(page_url, e):
+        if isinstance(e, DownloadRejected):
+            state.record_skip(page_url, e.reason, detail=e.detail)
+            report("warning", f"⏭️ Skipped {page_url} for {username} ({e})")
+        else:
+            report("error", f"❌ Failed to fetch {page_url} for {username}: {e}")
+
+    def handle(page_url, resp):
+        if resp.status_code == 304:
+            state.touch(page_url)
+            counts["unchanged"] += 1
+            return (state.get(page_url) or {}).get("links", []) if crawl_links else []
+        fname, ftype, links, status = _save_page(
+            page_url, resp, docs_dir, existing_docs, report, f" for {username}", state, boilerplate, dedup
+        )
+        counts[status] = counts.get(status, 0) + 1
+        if page_url == start_url:
+            result[:] = [fname, ftype]
+        return links if crawl_links else []
+
+    crawl(
+        url, handle,
+        page_limit=page_limit if crawl_links else 1,
+        follow=crawl_links,
+        on_fetch=(lambda u, n: report("info", f"Processing page {n}/{page_limit} for {username}: {u}"))
+        if crawl_links else None,
+        on_error=on_error,
+        on_limit=lambda: report("info", f"Page limit ({page_limit}) reached for user {username}"),
+        fetch_page=fetch_page,
+        canonicalize=canonicalize_url,
+        on_skip=lambda u, canonical: state.record_skip(u, "duplicate_url", canonical=canonical)
+    )
+    if counts["updated"] or counts["unchanged"]:
+        report("info", f"🔁 {url}: {counts['new']} new, {counts['updated']} changed, "
+                       f"{counts['unchanged']} unchanged pages for {username}")
+    if counts["duplicate"]:
+        report("info", f"🧹 Skipped {counts['duplicate']} duplicate pages for {username}")
+    return result[0], result[1]
+
+class BoilerplateFilter:
+    """
+    Learns, over one crawl, the DOM blocks repeated across a site's pages
+    (menus, headers, footers, sidebars) and strips them.
 
-    # Initialize for the first call in a crawl session
-    if _visited is None:
-        _visited = set()
-    if _crawl_count is None:
-        _crawl_count = [0, False]
-
-    # Stop if page limit is reached during a crawl
-    if crawl_links and _crawl_count[0] >= page_limit:
-        if not _crawl_count[1]:
-            st.info(f"Page limit ({page_limit}) reached for user {username}")
-            _crawl_count[1] = True
-        return "", ""
-
-    if url in _visited:
-        return "", ""
-
-    _visited.add(url)
-
-    if crawl_links:
-        _crawl_count[0] += 1
-        st.info(f"Processing page {_crawl_count[0]}/{page_limit} for {username}: {url}")
+    Every block element with a modest amount of text is fingerprinted by
+    its normalised text; once a fingerprint has been seen on `min_pages`
+    earlier pages of the crawl, the block is removed from later ones. The
+    first pages keep it, so its text is still indexed once.
+    """
 
-    # Fetch URL content (same as before)
+    def __init__(self, min_pages: int = BOILERPLATE_MIN_PAGES):
+        self.min_pages = min_pages
+        self._pages = Counter()   # fingerprint -> pages it appeared on
+
+    def strip(self, soup) -> int:
+        """Remove learned boilerplate from `soup`, then learn from it. Returns blocks removed."""
+        blocks = []
+        for el in soup.find_all(BLOCK_TAGS):
+            text = " ".join(el.get_text(" ", strip=True).split())
+            if BLOCK_MIN_CHARS <= len(text) <= BLOCK_MAX_CHARS:
+                blocks.append((el, hashlib.blake2b(text.lower().encode("utf-8"), digest_size=8).digest()))
+
+        removed = 0
+        for el, fingerprint in blocks:
+            # Children of a removed block are already gone
+            if self._pages[fingerprint] >= self.min_pages and not el.decomposed:
+                el.decompose()
+                removed += 1
+        self._pages.update({fingerprint for _, fingerprint in blocks})
+        return removed
+
+
+def _save_page(
+        url: str,
+        page: Download,
+        docs_dir: str,
+        existing_docs: List[str],
+        report=st_report,
+        label: str = "",
+        state: CrawlState = None,
+        boilerplate: BoilerplateFilter = None,
+        dedup: NearDuplicateIndex = None
+) -> Tuple[str, str, List[str], str]:
+    """
+    Save one downloaded page to `docs_dir` as a PDF or as its visible
+    text, parsing HTML once for both the text and the links. A PDF's temp
+    file is renamed into place, never read into memory; whatever is not
+    kept is removed.
+
+    Files are named after the URL's host and path, plus a short hash of
+    the query string when there is one. Without a crawl `state` a page
+    whose file already exists is skipped. With one, a file is only
+    overwritten when the state records it for this same URL and the
+    response body changed; a name already taken by another URL gets a
+    hash of the URL appended instead. The page's validators, body hash
+    and links are recorded. The body rather than the extracted text is
+    compared, since boilerplate stripping depends on the order pages are
+    crawled in.
+
+    An HTML page whose text `dedup` matches to an earlier page of the
+    crawl is not saved; its links are still returned.
+
+    Returns (filename written or "", "pdf"/"html", same-domain links,
+    status: "new", "updated", "unchanged", "duplicate" or "empty").
+    """
     try:
-        resp = requests.get(
-            url,
-            headers={"User-Agent": "Mozilla/5.0 (compatible; TNTBot/1.0)"},
-            timeout=10
-        )
-        resp.raise_for_status()
-    except Exception as e:
-        st.error(f"❌ Failed to fetch {url} for {username}: {e}")
-        return "", ""
-
-    # Process content (same logic as before, but save to user's docs_dir)
-    parsed = urlparse(url)
-    base = slugify(parsed.netloc + parsed.path)
-    ctype = resp.headers.get("Content-Type", "").lower()
-    is_pdf = url.lower().endswith(".pdf") or "application/pdf" in ctype
-
-    if is_pdf:
-        fname = f"{base}.pdf"
-        if fname in existing_docs:
-            return "", "pdf"
-        path = os.path.join(docs_dir, fname)
-        with open(path, "wb") as f:
-            f.write(resp.content)
-        st.success(f"✅ Saved PDF for {username}: {url}")
-        existing_docs.append(fname)
-        return fname, "pdf"
-
-    # HTML processing (same as before)
-    encoding = resp.encoding if resp.encoding else 'utf-8'
-    html_text = resp.content.decode(encoding, errors='replace')
-    text = extract_all_visible_text(html_text)
-
-    if not text:
-        return "", "html"
-
-    fname = f"{base}.html.txt"
-    if fname in existing_docs:
-        return "", "html"
-    path = os.path.join(docs_dir, fname)
-    with open(path, "w", encoding="utf-8") as f:
-        f.write(text)
-    st.success(f"✅ Saved HTML for {username}: {url}")
-    existing_docs.append(fname)
-
-    # Recursive crawling for same domain
-    if crawl_links:
-        links = extract_same_domain_links(html_text, url)
-        for link in links:
-            save_url_to_vectordb_user(
-                username, link, existing_docs, crawl_links, page_limit, _visited, _crawl_count
+        parsed = urlparse(url)
+        base = slugify(parsed.netloc + parsed.path)
+        if parsed.query:
+            # The path alone maps every ?id=… of a script to the same file
+            base = f"{base}_{_short_hash(parsed.query)}"
+
+        if page.kind == "pdf":
+            ftype, kind, links = "pdf", "PDF", []
+            suffix = ".pdf"
+            data = None
+            data_hash = page.sha256
+        else:
+            ftype, kind = "html", "HTML"
+            text, links = parse_page(page.read_text(), page.final_url, boilerplate)
+            if not text:
+                return "", ftype, links, "empty"
+            match = dedup.check(url, text) if dedup is not None else None
+            if match:
+                reason, original, distance = match
+                if state is not None:
+                    state.record_skip(url, reason, original=original, distance=distance)
+                else:
+                    print(f"Skipping {url}: {reason} of {original}")
+                return "", ftype, links, "duplicate"
+            suffix = ".html.txt"
+            data = text.encode("utf-8")
+            data_hash = hashlib.sha256(data).hexdigest()
+
+        fname = f"{base}{suffix}"
+        # Used when `fname` is already taken by another URL
+        own_fname = f"{base}_{_short_hash(url)}{suffix}"
+        saved = state.get(url) if state is not None else None
+        if saved and saved["fname"] in (fname, own_fname):
+            # Written by this URL on an earlier crawl
+            fname = saved["fname"]
+            path = os.path.join(docs_dir, fname)
+            if not os.path.exists(path):
+                status = "new"
+            elif saved["content_hash"]:
+                status = "unchanged" if saved["content_hash"] == page.sha256 else "updated"
+            else:
+                status = "unchanged" if file_sha256(path) == data_hash else "updated"
+        else:
+            path = os.path.join(docs_dir, fname)
+            if fname in existing_docs or os.path.exists(path):
+                if state is None:
+                    return "", ftype, links, "unchanged"
+                if (state.owner(fname) is None and os.path.exists(path)
+                        and file_sha256(path) == data_hash):
+                    # This page, saved before crawl state existed
+                    status = "unchanged"
+                else:
+                    # Another URL's file: never overwrite it
+                    fname = own_fname
+                    path = os.path.join(docs_dir, fname)
+                    status = "updated" if os.path.exists(path) else "new"
+            else:
+                status = "new"
+
+        if status != "unchanged":
+            if data is None:
+                page.commit(path)
+            else:
+                atomic_write(path, data)
+            if status == "new":
+                report("success", f"✅ Saved {kind}{label}: {url}")
+                if fname not in existing_docs:
+                    existing_docs.append(fname)
+            else:
+                report("success", f"🔄 Updated {kind}{label}: {url}")
+        if state is not None:
+            state.record(
+                url, fname, page.headers.get("ETag"), page.headers.get("Last-Modified"), page.sha256, links
             )
+        return (fname if status != "unchanged" else ""), ftype, links, status
+    finally:
+        page.discard()
+
+def _short_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=4).hexdigest()
 
-    return fname, "html"
 
 def slugify(text: str) -> str:
     """Generate a filesystem-safe slug from the given text."""
@@ -114,37 +272,22 @@ def slugify(text: str) -> str:
     return slug.strip('_')
 
 
-def extract_all_visible_text(html: str) -> str:
+def parse_page(html: str, base_url: str, boilerplate: BoilerplateFilter = None) -> Tuple[str, List[str]]:
     """
-    Extracts all visible text from an HTML document,
-    excluding scripts, styles, nav bars (after first scan), and other non-content elements.
+    Parse an HTML page once and return (visible text, same-domain links).
+
+    Links are collected before anything is stripped, so navigation still
+    drives the crawl. Scripts, styles and other non-content elements are
+    removed, then the blocks `boilerplate` has learned for this crawl.
     """
-    global first_scan_done
-    soup = BeautifulSoup(html, "html.parser")
+    soup = BeautifulSoup(html, HTML_PARSER)
+    links = _same_domain_links(soup, base_url) if base_url else []
 
     # Remove non-content elements
     for tag in soup(["script", "style", "noscript", "meta", "iframe"]):
         tag.decompose()
-
-    # Remove nav bar after first scan
-    if first_scan_done:
-        # Remove by common nav bar tags/classes/ids
-        nav_selectors = [
-            'nav',
-            '[class*="nav"]',
-            '[class*="menu"]',
-            '[class*="header"]',
-            '[id*="nav"]',
-            '[id*="menu"]',
-            '[id*="header"]',
-            '[role="navigation"]'
-        ]
-        for selector in nav_selectors:
-            for nav in soup.select(selector):
-                nav.decompose()
-    # Mark first scan as done
-    if not first_scan_done:
-        first_scan_done = True
+    if boilerplate is not None:
+        boilerplate.strip(soup)
 
     # Extract text
     raw_text = soup.get_text(separator="\n")
@@ -153,17 +296,27 @@ def extract_all_visible_text(html: str) -> str:
     lines = [line.strip() for line in raw_text.splitlines()]
     lines = [line for line in lines if line]
 
-    return "\n\n".join(lines)
+    return "\n\n".join(lines), links
+
+
+def extract_all_visible_text(html: str) -> str:
+    """
+    Extracts all visible text from an HTML document,
+    excluding scripts, styles and other non-content elements.
+    """
+    return parse_page(html, "")[0]
 
 
 def extract_same_domain_links(html: str, base_url: str) -> List[str]:
     """
     Extract all same-domain links from HTML content, skipping English versions and image files.
     """
-    soup = BeautifulSoup(html, "html.parser")
+    return parse_page(html, base_url)[1]
+
+
+def _same_domain_links(soup, base_url: str) -> List[str]:
     parsed_base = urlparse(base_url)
     base_domain = parsed_base.netloc
-    base_scheme = parsed_base.scheme
     links = set()
     for a in soup.find_all("a", href=True):
         if not isinstance(a, Tag):
@@ -196,9 +349,7 @@ def save_url_to_vectordb(
     existing_docs: List[str],
     docs_dir: str = "docs",
     crawl_links: bool = False,
-    page_limit: int = 50,
-    _visited: Optional[Set[str]] = None,
-    _crawl_count: Optional[list] = None
+    page_limit: int = 50
 ) -> Tuple[str, str]:
     """
     Fetch a URL (HTML or PDF), save it to `docs/`, and tell the caller
@@ -209,81 +360,32 @@ def save_url_to_vectordb(
       (filename, file_type) where file_type is "pdf" or "html".
       If nothing was written (already exists or error), filename == "".
     """
-    # Initialize for the first call in a crawl session
-    if _visited is None:
-        _visited = set()
-    if _crawl_count is None:
-        _crawl_count = [0, False] # [count, limit_reached_flag]
-
-    # Stop if page limit is reached during a crawl
-    if crawl_links and _crawl_count[0] >= page_limit:
-        if not _crawl_count[1]: # If the limit message hasn't been printed yet
-            print(f"Page limit ({page_limit}) reached. Halting further crawling.")
-            _crawl_count[1] = True # Mark that the message has been printed
-        return "", ""
-        
-    if url in _visited:
-        print(f"Skipping already visited: {url}")
-        return "", ""
-
-    _visited.add(url)
-    
-    # This is a new page being processed, so increment the counter if crawling
-    if crawl_links:
-        _crawl_count[0] += 1
-        print(f"Processing page {_crawl_count[0]}/{page_limit}: {url}")
-
-    # 1) Fetch the URL content
-    try:
-        resp = requests.get(
-            url,
-            headers={"User-Agent": "Mozilla/5.0 (compatible; TNTBot/1.0)"},
-            timeout=10
-        )
-        resp.raise_for_status()
-    except Exception as e:
-        st.error(f"❌ Failed to fetch {url}: {e}")
-        return "", ""
-
     os.makedirs(docs_dir, exist_ok=True)
-    parsed = urlparse(url)
-    base = slugify(parsed.netloc + parsed.path)
-    ctype = resp.headers.get("Content-Type", "").lower()
-    is_pdf = url.lower().endswith(".pdf") or "application/pdf" in ctype
-
-    if is_pdf:
-        fname = f"{base}.pdf"
-        if fname in existing_docs:
-            return "", "pdf"
-        path = os.path.join(docs_dir, fname)
-        with open(path, "wb") as f:
-            f.write(resp.content)
-        st.success(f"✅ Saved PDF: {url}")
-        existing_docs.append(fname)
-        return fname, "pdf"
-
-    encoding = resp.encoding if resp.encoding else 'utf-8'
-    html_text = resp.content.decode(encoding, errors='replace')
-    text = extract_all_visible_text(html_text)
-
-    if not text:
-        return "", "html"
-
-    fname = f"{base}.html.txt"
-    if fname in existing_docs:
-        return "", "html"
-    path = os.path.join(docs_dir, fname)
-    with open(path, "w", encoding="utf-8") as f:
-        f.write(text)
-    st.success(f"✅ Saved HTML: {url}")
-    existing_docs.append(fname)
-
-    if crawl_links:
-        links = extract_same_domain_links(html_text, url)
-        for link in links:
-            # The check at the top of the function handles the limit for recursion
-            save_url_to_vectordb(
-                link, existing_docs, docs_dir, crawl_links, page_limit, _visited, _crawl_count
-            )
+    result = ["", ""]
+    start_url = canonicalize_url(url)
+
+    boilerplate = BoilerplateFilter()
+    dedup = NearDuplicateIndex()
 
-    return fname, "html"
+    def handle(page_url, resp):
+        fname, ftype, links, _ = _save_page(
+            page_url, resp, docs_dir, existing_docs, boilerplate=boilerplate, dedup=dedup
+        )
+        if page_url == start_url:
+            result[:] = [fname, ftype]
+        return links if crawl_links else []
+
+    def on_limit():
+        print(f"Page limit ({page_limit}) reached. Halting further crawling.")
+
+    crawl(
+        url, handle,
+        page_limit=page_limit if crawl_links else 1,
+        follow=crawl_links,
+        on_fetch=(lambda u, n: print(f"Processing page {n}/{page_limit}: {u}")) if crawl_links else None,
+        on_error=lambda u, e: st.error(f"❌ Failed to fetch {u}: {e}"),
+        on_limit=on_limit,
+        fetch_page=lambda u: download(u, docs_dir),
+        canonicalize=canonicalize_url
+    )
+    return result[0], result[1]
@@ -0,0 +1,35 @@
+# utils/sqlite_db.py
+
+import sqlite3
+from contextlib import closing
+
+# --- Constants ---
+SQLITE_TIMEOUT = 30   # seconds to wait for another writer's lock
+
+
+class Transaction:
+    """Commit-and-close wrapper around a sqlite3 connection."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        with closing(self.conn):
+            if exc_type is None:
+                self.conn.commit()
+            else:
+                self.conn.rollback()
+        return False
+
+
+def connect(path: str) -> Transaction:
+    """
+    A short-lived connection to the database at `path`, committed and
+    closed when the `with` block ends. Used by the small per-store indexes
+    (chunk index, chunk archive, BM25, crawl state): their files can be
+    deleted from under us by a user reset and are shared by worker threads.
+    """
+    return Transaction(sqlite3.connect(path, timeout=SQLITE_TIMEOUT))
@@ -0,0 +1,137 @@
+# utils/url_dedup.py
+
+import re
+import hashlib
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, quote, urlencode, urlsplit, urlunsplit
+
+# --- Constants ---
+TRACKING_PARAMS = {
+    "fbclid", "gclid", "dclid", "msclkid", "yclid", "mc_cid", "mc_eid", "igshid",
+    "_ga", "_gl", "ref", "ref_src", "spm", "zarsrc", "sessionid", "phpsessid", "jsessionid",
+}
+TRACKING_PREFIXES = ("utm_", "pk_", "hsa_")
+# (param, values) pairs that only switch a page to its print view
+PRINT_PARAMS = {"print": None, "printable": None, "view": {"print"}, "format": {"print"}, "output": {"print"}}
+INDEX_PAGES = ("index.html", "index.htm", "index.php", "index.asp", "index.aspx", "default.asp", "default.aspx")
+DEFAULT_PORTS = {"http": 80, "https": 443}
+UNRESERVED    = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~")
+PATH_SAFE     = "/%:@!$&'()*+,;=-._~"
+
+SIMHASH_BITS       = 64
+SIMHASH_MAX_DIST   = 3    # Hamming distance still counted as the same page
+SIMHASH_MIN_TOKENS = 30   # shorter texts are only compared exactly
+
+
+def _is_tracking(name: str) -> bool:
+    name = name.lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+
+def _is_print_view(name: str, value: str) -> bool:
+    name = name.lower()
+    if name not in PRINT_PARAMS:
+        return False
+    values = PRINT_PARAMS[name]
+    return values is None or value.lower() in values
+
+
+def _normalize_escapes(path: str) -> str:
+    """
+    Decode percent-escapes of unreserved characters and upper-case the
+    rest (RFC 3986 6.2.2), then escape raw characters that need it.
+    Reserved characters stay encoded: %2F is not the same path as /.
+    """
+    def fix(m):
+        char = chr(int(m.group(1), 16))
+        return char if char in UNRESERVED else "%" + m.group(1).upper()
+    return quote(re.sub(r"%([0-9A-Fa-f]{2})", fix, path), safe=PATH_SAFE)
+
+
+def canonicalize_url(url: str) -> str:
+    """
+    Normalise a URL so variants of one page compare equal: lower-case
+    scheme and host, default port, fragment, tracking and print-view
+    parameters and index pages dropped, duplicate and trailing slashes
+    removed, remaining parameters sorted and percent-encoding normalised.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower().rstrip(".")
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+
+    path = _normalize_escapes(parts.path)
+    path = re.sub(r"/{2,}", "/", path)
+    head, _, last = path.rpartition("/")
+    if last.lower() in INDEX_PAGES:
+        path = head + "/"
+    if len(path) > 1:
+        path = path.rstrip("/")
+    path = path or "/"
+
+    params = [
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not _is_tracking(k) and not _is_print_view(k, v)
+    ]
+    query = urlencode(sorted(params))
+    return urlunsplit((scheme, host, path, query, ""))
+
+
+def simhash(text: str) -> int:
+    """64-bit SimHash over word 3-shingles of `text`."""
+    words = re.findall(r"\w+", text.lower())
+    shingles = [" ".join(words[i:i + 3]) for i in range(max(1, len(words) - 2))]
+    weights = [0] * SIMHASH_BITS
+    for shingle in shingles:
+        h = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little")
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if (h >> bit) & 1 else -1
+    return sum(1 << bit for bit, w in enumerate(weights) if w > 0)
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class NearDuplicateIndex:
+    """
+    Pages seen so far in a crawl, for spotting the same content under
+    another URL. Longer texts match by SimHash within SIMHASH_MAX_DIST
+    bits, looked up through band buckets instead of a scan; short texts
+    must match exactly.
+    """
+
+    def __init__(self, max_distance: int = SIMHASH_MAX_DIST):
+        self.max_distance = max_distance
+        # Pigeonhole: hashes within max_distance bits agree on at least one of max_distance + 1 bands
+        self._band_bits = SIMHASH_BITS // (max_distance + 1)
+        self._buckets: Dict[Tuple[int, int], List[Tuple[int, str]]] = {}
+        self._exact: Dict[str, str] = {}
+
+    def _bands(self, value: int):
+        mask = (1 << self._band_bits) - 1
+        for band in range(self.max_distance + 1):
+            yield band, (value >> (band * self._band_bits)) & mask
+
+    def check(self, url: str, text: str) -> Optional[Tuple[str, str, int]]:
+        """
+        (reason, URL of the earlier page, distance) if `text` duplicates a
+        page already added, else None after adding this one.
+        """
+        digest = hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()
+        if digest in self._exact:
+            return "duplicate_content", self._exact[digest], 0
+
+        if len(re.findall(r"\w+", text)) >= SIMHASH_MIN_TOKENS:
+            value = simhash(text)
+            for key in self._bands(value):
+                for other, other_url in self._buckets.get(key, ()):
+                    distance = hamming(value, other)
+                    if distance <= self.max_distance:
+                        return "near_duplicate", other_url, distance
+            for key in self._bands(value):
+                self._buckets.setdefault(key, []).append((value, url))
+        # Only accepted pages become originals
+        self._exact[digest] = url
+        return None